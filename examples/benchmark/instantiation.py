@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import sys
+import time
+from itertools import product
+
+ARGV = list(sys.argv) # Importing pddlstream.downward overwrites sys.argv for the FastDownward translator
+
+from pddlstream.conversion import evaluations_from_init, head_from_fact, is_atom, get_prefix, get_args
+from pddlstream.instantiation import Instantiator, get_mapping
+from pddlstream.object import Object, ObjectRegistry
+from pddlstream.stream import parse_stream_pddl, from_test
+
+STREAM_PDDL = """
+(define (stream benchmark)
+  (:stream connect
+    :inputs (?q1 ?q2)
+    :domain (and (Conf ?q1) (Conf ?q2))
+    :outputs ()
+    :certified (Connected ?q1 ?q2)
+  )
+  (:stream traverse
+    :inputs (?q1 ?q2 ?t)
+    :domain (and (Conf ?q1) (Conf ?q2) (Motion ?q1 ?t ?q2))
+    :outputs ()
+    :certified (Traversable ?t)
+  )
+)
+"""
+
+##################################################
+
+class ProductInstantiator(Instantiator):
+    # The previous cartesian product instantiation for reference
+    def add_atom(self, atom):
+        if not is_atom(atom):
+            return False
+        head = atom.head
+        if head in self.atoms:
+            return False
+        self.atoms.add(head)
+        for i, stream in enumerate(self.streams):
+            for j, domain_atom in enumerate(stream.domain):
+                if get_prefix(head) != get_prefix(domain_atom):
+                    continue
+                if any(isinstance(b, Object) and (a != b) for (a, b) in
+                       zip(head.args, get_args(domain_atom))):
+                    continue
+                self.atoms_from_domain[(i, j)].append(head)
+                values = [self.atoms_from_domain[(i, k)] if j != k else [head]
+                          for k in range(len(stream.domain))]
+                domain = list(map(head_from_fact, stream.domain))
+                for combo in product(*values):
+                    mapping = get_mapping(domain, combo)
+                    if mapping is None:
+                        continue
+                    self._add_instance(stream, tuple(mapping[p] for p in stream.inputs))
+        return True
+
+
+def get_init(num_confs):
+    init = [('Conf', q) for q in range(num_confs)]
+    init += [('Motion', q, (q, q + 1), q + 1) for q in range(num_confs - 1)]
+    return init
+
+
+def benchmark(instantiator_cls, num_confs):
+    with ObjectRegistry():
+        stream_map = {
+            'connect': from_test(lambda q1, q2: True),
+            'traverse': from_test(lambda q1, q2, t: True),
+        }
+        _, streams = parse_stream_pddl(STREAM_PDDL, stream_map, {})
+        evaluations = evaluations_from_init(get_init(num_confs))
+        start_time = time.time()
+        instantiator = instantiator_cls(evaluations, streams)
+        return len(instantiator.stream_instances), time.time() - start_time
+
+##################################################
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--max_confs', default=256, type=int, help='The maximum number of Conf facts')
+    args = parser.parse_args(ARGV[1:])
+    num_confs = 8
+    while num_confs <= args.max_confs:
+        num_instances, indexed_time = benchmark(Instantiator, num_confs)
+        product_instances, product_time = benchmark(ProductInstantiator, num_confs)
+        assert num_instances == product_instances
+        print('Confs: {} | Instances: {} | Indexed: {:.3f} | Product: {:.3f} | Speedup: {:.1f}'.format(
+            num_confs, num_instances, indexed_time, product_time, product_time / max(indexed_time, 1e-6)))
+        num_confs *= 2
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,7 @@ from collections import OrderedDict, defaultdict
 from pddlstream.conversion import evaluations_from_init, obj_from_value_expression, obj_from_pddl_plan, \
     evaluation_from_fact
 from pddlstream.downward import parse_domain, get_problem, task_from_domain_problem, \
-    solve_from_task
+    solve_from_task, solve_anytime
 from pddlstream.object import Object
 from pddlstream.stream import parse_stream_pddl
 from pddlstream.utils import get_length, elapsed_time, INF
@@ -56,6 +56,15 @@ def solve_finite(evaluations, goal_expression, domain, unit_costs=None, **kwargs
     plan_pddl, cost = solve_from_task(task, **kwargs)
     return obj_from_pddl_plan(plan_pddl), cost
 
+def solve_finite_anytime(evaluations, goal_expression, domain, unit_costs=None, **kwargs):
+    # Generator of successively cheaper (plan, cost) pairs
+    if unit_costs is None:
+        unit_costs = not has_costs(domain)
+    problem = get_problem(evaluations, goal_expression, domain, unit_costs)
+    task = task_from_domain_problem(domain, problem)
+    for plan_pddl, cost in solve_anytime(task, **kwargs):
+        yield obj_from_pddl_plan(plan_pddl), cost
+
 
 def neighbors_from_orders(orders):
     incoming_edges = defaultdict(set)
@@ -77,16 +86,19 @@ class SolutionStore(object):
         self.verbose = verbose
         self.best_plan = None
         self.best_cost = INF
+        self.solutions = [] # (plan, cost, time) for each improvement
         #self.best_cost = self.cost_fn(self.best_plan)
     def add_plan(self, plan, cost):
-        # TODO: list of plans
         if cost < self.best_cost:
             self.best_plan = plan
             self.best_cost = cost
+            self.solutions.append((plan, cost, self.elapsed_time()))
     def is_solved(self):
         return self.best_cost < self.max_cost
     def elapsed_time(self):
         return elapsed_time(self.start_time)
+    def time_remaining(self):
+        return max(self.max_time - self.elapsed_time(), 0)
     def is_timeout(self):
         return self.max_time <= self.elapsed_time()
     def is_terminated(self):
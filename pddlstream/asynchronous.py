@@ -0,0 +1,119 @@
+from __future__ import print_function
+
+# Python 3 only: imported lazily by externals with async generator or coroutine functions
+
+import asyncio
+import threading
+import time
+
+from pddlstream.function import Function
+from pddlstream.utils import elapsed_time
+
+_local = threading.local()
+
+def get_event_loop():
+    # Async generators must always be advanced by the same loop
+    if getattr(_local, 'loop', None) is None:
+        _local.loop = asyncio.new_event_loop()
+    return _local.loop
+
+##################################################
+
+def from_async_fn(fn):
+    # async fn(*input_values) -> output tuple or None
+    async def list_fn(*input_values):
+        outputs = await fn(*input_values)
+        return [] if outputs is None else [outputs]
+    return list_fn
+
+
+def from_async_test(test):
+    async def fn(*input_values):
+        return tuple() if (await test(*input_values)) else None
+    return from_async_fn(fn)
+
+
+def from_async_gen_fn(gen_fn):
+    # async generator gen_fn(*input_values) of output tuples or None
+    async def list_gen_fn(*input_values):
+        async for output_values in gen_fn(*input_values):
+            yield [] if output_values is None else [output_values]
+    return list_gen_fn
+
+##################################################
+
+async def next_outputs(instance):
+    # Async generator functions are list generators and coroutine functions are list functions
+    external = instance.external
+    fn = external.fn if isinstance(external, Function) else external.gen_fn
+    input_values = instance.get_input_values()
+    if not external.is_generator:
+        outputs = await fn(*input_values)
+        instance._exhausted = True
+        return outputs
+    if instance._generator is None:
+        instance._generator = fn(*input_values)
+    try:
+        return await instance._generator.__anext__()
+    except StopAsyncIteration:
+        instance._exhausted = True
+        return []
+
+
+async def evaluate(instance):
+    start_time = time.time()
+    outputs = await next_outputs(instance)
+    return outputs, elapsed_time(start_time)
+
+
+def run_next_outputs(instance):
+    return get_event_loop().run_until_complete(next_outputs(instance))
+
+
+def next_results_concurrently(instances, verbose=False):
+    # Calls each (distinct) instance once, awaiting all of the calls concurrently
+    async def evaluate_all():
+        return await asyncio.gather(*map(evaluate, instances))
+    outputs = get_event_loop().run_until_complete(evaluate_all())
+    return [instance._process_outputs(values, time.time() - overhead, verbose=verbose)
+            for instance, (values, overhead) in zip(instances, outputs)]
+
+##################################################
+
+class AsyncResult(object):
+    """
+    Mirrors multiprocessing.pool.AsyncResult for a task on the event loop
+    The loop only runs while the caller waits, which advances every pending task concurrently
+    """
+    def __init__(self, loop, task):
+        self.loop = loop
+        self.task = task
+    def ready(self):
+        return self.task.done()
+    def wait(self, timeout=None):
+        if not self.ready():
+            self.loop.run_until_complete(asyncio.wait([self.task], timeout=timeout))
+    def get(self):
+        self.wait()
+        return self.task.result()
+
+
+class AsyncPool(object):
+    """
+    Concurrently awaits the outputs of async stream and function instances
+    """
+    def __init__(self):
+        self.loop = get_event_loop()
+        self.tasks = set()
+    def submit(self, instance):
+        task = self.loop.create_task(evaluate(instance))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return AsyncResult(self.loop, task)
+    def terminate(self):
+        for task in list(self.tasks):
+            task.cancel()
+        if self.tasks:
+            self.loop.run_until_complete(asyncio.wait(list(self.tasks)))
+    def join(self):
+        pass
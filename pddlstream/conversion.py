@@ -3,7 +3,7 @@ from __future__ import print_function
 import collections
 from collections import namedtuple
 
-from pddlstream.object import Object, OptimisticObject
+from pddlstream.object import Object, OptimisticObject, get_object_registry
 from pddlstream.utils import str_from_tuple
 
 EQ = '=' # xnor
@@ -25,8 +25,95 @@ QUANTIFIERS = (FORALL, EXISTS)
 OPERATORS = CONNECTIVES + QUANTIFIERS + (WHEN,)
 
 Problem = namedtuple('Problem', ['domain_pddl', 'constant_map', 'stream_pddl', 'stream_map', 'init', 'goal'])
-Head = namedtuple('Head', ['function', 'args'])
-Evaluation = namedtuple('Evaluation', ['head', 'value'])
+
+class Head(object):
+    """
+    Interned (function, args) pair with a precomputed hash and a dense integer index
+    The intern table is owned by the active ObjectRegistry
+    """
+    __slots__ = ('function', 'args', 'index', '_hash')
+    def __new__(cls, function, args):
+        args = tuple(args)
+        key = (function, args)
+        head_from_key = get_object_registry().head_from_key
+        head = head_from_key.get(key, None)
+        if head is None:
+            head = object.__new__(cls)
+            head.function = function
+            head.args = args
+            head.index = len(head_from_key)
+            head._hash = hash(key)
+            head_from_key[key] = head
+        return head
+    def __reduce__(self):
+        return Head, (self.function, self.args)
+    def __hash__(self):
+        return self._hash
+    def __eq__(self, other):
+        # Identity unless the intern table was cleared
+        if isinstance(other, tuple): # Like the previous namedtuple (and with the same hash)
+            return (self.function, self.args) == other
+        return (self is other) or (isinstance(other, Head) and (self._hash == other._hash) and
+                                   (self.function == other.function) and (self.args == other.args))
+    def __ne__(self, other):
+        return not self == other
+    def __iter__(self):
+        return iter((self.function, self.args))
+    def __getitem__(self, index):
+        return (self.function, self.args)[index]
+    def __len__(self):
+        return 2
+    def __lt__(self, other):
+        return tuple(self) < tuple(other)
+    def __repr__(self):
+        return 'Head(function={!r}, args={!r})'.format(self.function, self.args)
+
+
+class Evaluation(object):
+    """
+    Interned (head, value) pair with a precomputed hash and a dense integer index
+    The table is keyed on the value type as well because True == 1 and False == 0
+    """
+    __slots__ = ('head', 'value', 'index', '_hash', '_fact')
+    def __new__(cls, head, value):
+        evaluation_from_key = get_object_registry().evaluation_from_key
+        try:
+            key = (head, type(value), value)
+            evaluation = evaluation_from_key.get(key, None)
+        except TypeError: # Unhashable values are not interned
+            key, evaluation = None, None
+        if evaluation is None:
+            evaluation = object.__new__(cls)
+            evaluation.head = head
+            evaluation.value = value
+            evaluation.index = len(evaluation_from_key)
+            evaluation._hash = hash((head, value)) if key is not None else hash(head)
+            evaluation._fact = None
+            if key is not None:
+                evaluation_from_key[key] = evaluation
+        return evaluation
+    def __reduce__(self):
+        return Evaluation, (self.head, self.value)
+    def __hash__(self):
+        return self._hash
+    def __eq__(self, other):
+        if isinstance(other, tuple):
+            return (self.head, self.value) == other
+        return (self is other) or (isinstance(other, Evaluation) and (self._hash == other._hash) and
+                                   (self.head == other.head) and (self.value == other.value))
+    def __ne__(self, other):
+        return not self == other
+    def __iter__(self):
+        return iter((self.head, self.value))
+    def __getitem__(self, index):
+        return (self.head, self.value)[index]
+    def __len__(self):
+        return 2
+    def __lt__(self, other):
+        return tuple(self) < tuple(other)
+    def __repr__(self):
+        return 'Evaluation(head={!r}, value={!r})'.format(self.head, self.value)
+
 Atom = lambda head: Evaluation(head, True)
 NegatedAtom = lambda head: Evaluation(head, False)
 
@@ -150,6 +237,19 @@ def head_from_fact(fact):
     return Head(get_prefix(fact), get_args(fact))
 
 def evaluation_from_fact(fact):
+    # Function values are keyed on their type as well because True == 1
+    key = (fact, type(fact[2])) if get_prefix(fact) == EQ else fact
+    evaluation_from_fact = get_object_registry().evaluation_from_fact
+    try:
+        evaluation = evaluation_from_fact.get(key, None)
+    except TypeError: # Unhashable function value
+        return _evaluation_from_fact_aux(fact)
+    if evaluation is None:
+        evaluation = _evaluation_from_fact_aux(fact)
+        evaluation_from_fact[key] = evaluation
+    return evaluation
+
+def _evaluation_from_fact_aux(fact):
     prefix = get_prefix(fact)
     if prefix == EQ:
         head, value = fact[1:]
@@ -169,6 +269,11 @@ def evaluations_from_init(init):
 # TODO: generic method for replacing args?
 
 def fact_from_evaluation(evaluation):
+    if evaluation._fact is None:
+        evaluation._fact = _fact_from_evaluation_aux(evaluation)
+    return evaluation._fact
+
+def _fact_from_evaluation_aux(evaluation):
     head = (evaluation.head.function,) + evaluation.head.args
     if is_atom(evaluation):
         return head
@@ -200,9 +305,9 @@ def state_from_evaluations(evaluations):
 ##################################################
 
 def obj_from_pddl(pddl):
-    if pddl in Object._obj_from_name:
+    if Object.has_name(pddl):
         return Object.from_name(pddl)
-    elif pddl in OptimisticObject._obj_from_name:
+    elif OptimisticObject.has_name(pddl):
         return OptimisticObject.from_name(pddl)
     else:
         raise ValueError(pddl)
@@ -1,14 +1,32 @@
 from __future__ import print_function
 
+import hashlib
+import math
 import os
+import pickle
 import re
+import shlex
 import sys
+import tempfile
+import threading
 from collections import namedtuple
-from time import time
+from time import time, sleep
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 from pddlstream.conversion import is_atom, is_negated_atom, objects_from_evaluations, pddl_from_object, \
     pddl_list_from_expression, get_prefix, get_args, obj_from_pddl, NOT, EQ
-from pddlstream.utils import read, write, safe_rm_dir, INF, Verbose, TmpCWD, clear_dir, get_file_path
+from pddlstream.grounding import incremental_pddl_to_sas
+from pddlstream.report import Phase, start_call, finish_call, get_sas_sizes, record_sizes, record_cache_hit
+from pddlstream.sas_search import python_search, use_python_search
+from pddlstream.state import BitState
+from pddlstream.statistics import record_planner_win, select_planner
+from pddlstream.utils import read, write, safe_rm_dir, INF, Verbose, TmpCWD, clear_dir, get_file_path, LRUCache, \
+    read_pickle, write_pickle, ensure_dir
+from pddlstream.workers import get_search_pool, KILL_GRACE
 
 # FD_PATH = os.environ['FD_PATH']
 FD_PATH = get_file_path(__file__, '../FastDownward/builds/release32/')
@@ -30,10 +48,15 @@ from pddl_parser.parsing_functions import parse_domain_pddl, parse_task_pddl, \
     parse_condition, check_for_duplicates
 
 
-TEMP_DIR = 'temp/'
+TEMP_DIR = 'temp/' # Shared fallback when no TempDirectory is active
+SCRATCH_ROOT = '/dev/shm' # tmpfs on Linux
 TRANSLATE_OUTPUT = 'output.sas'
 SEARCH_OUTPUT = 'sas_plan'
-SEARCH_COMMAND = 'downward --internal-plan-file %s %s < %s'
+SEARCH_BINARY = 'downward'
+PLAN_STDOUT = '/dev/stdout' # Plan is interleaved with the search log
+IN_MEMORY = False # Streams tasks and plans through pipes instead of temp_dir
+IN_PROCESS = True # Solves small tasks (see use_python_search) within Python instead of with FastDownward
+INCREMENTAL_GROUNDING = False # Extends the previous relaxed reachability model with new facts
 
 # TODO: be careful when doing costs. Might not be admissible if use plus one for heuristic
 # TODO: use goal_serialization / hierarchy on the inside loop of these
@@ -82,19 +105,116 @@ SEARCH_OPTIONS = {
                '--search "lazy_greedy([hff],preferred=[hff],max_time=%s,bound=%s)"',
 }
 
+# Configurations launched in parallel when planner='portfolio'
+PORTFOLIO = ['ff-astar', 'ff-wastar3', 'cea-wastar3', 'ff-lazy']
+PORTFOLIO_PLANNER = 'portfolio'
+POLL_PERIOD = 1e-2
+
+CACHE_TRANSLATIONS = True
+MAX_CACHE_SIZE = 10**8 # Characters of serialized SAS
+
+CACHE_PARSES = True
+MAX_PARSE_CACHE_SIZE = 10**8 # Bytes of pickled domains and lisp lists
+PARSE_CACHE_DIR = None # Set to a directory to also persist parsed domains across processes
+
 
 #
 
+class TempDirectory(object):
+    """
+    Unique scratch directory used by every search within a solve
+    Allows several solves to run concurrently from the same working directory
+    """
+    _active = threading.local()
+    def __init__(self, root=None, clean=True):
+        if root is None:
+            root = SCRATCH_ROOT if os.access(SCRATCH_ROOT, os.W_OK) else None
+        self.root = root
+        self.clean = clean
+        self.path = None
+    @staticmethod
+    def get_stack():
+        if not hasattr(TempDirectory._active, 'stack'):
+            TempDirectory._active.stack = []
+        return TempDirectory._active.stack
+    def __enter__(self):
+        self.path = os.path.join(tempfile.mkdtemp(prefix='pddlstream-', dir=self.root), '')
+        self.get_stack().append(self)
+        return self
+    def __exit__(self, type, value, traceback):
+        self.get_stack().remove(self)
+        if self.clean:
+            safe_rm_dir(self.path)
+
+
+def get_temp_dir():
+    stack = TempDirectory.get_stack()
+    if stack:
+        return stack[-1].path
+    return TEMP_DIR
+
+#
+
+# Values are stored pickled so every lookup returns a fresh copy that callers may mutate
+# (e.g. parse_constants and compile_to_exogenous modify the domain)
+PARSE_CACHE = LRUCache(max_size=MAX_PARSE_CACHE_SIZE, size_fn=len)
+
+
+def get_parse_filename(key):
+    return os.path.join(PARSE_CACHE_DIR, '{}.pp'.format(key))
+
+
+def load_parse(key):
+    data = PARSE_CACHE.get(key)
+    if data is not None:
+        return pickle.loads(data)
+    if (PARSE_CACHE_DIR is None) or not os.path.exists(get_parse_filename(key)):
+        return None
+    try:
+        value = read_pickle(get_parse_filename(key))
+    except Exception: # Truncated or written by an incompatible translator
+        return None
+    PARSE_CACHE.add(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    return value
+
+
+def save_parse(key, value):
+    PARSE_CACHE.add(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    if PARSE_CACHE_DIR is not None:
+        filename = get_parse_filename(key)
+        ensure_dir(filename)
+        temp_filename = '{}.{}'.format(filename, os.getpid())
+        write_pickle(temp_filename, value)
+        os.rename(temp_filename, filename) # Atomic for concurrent workers
+    return value
+
+
+def cached_parse(prefix, text, parse_fn):
+    if not CACHE_PARSES:
+        return parse_fn(text)
+    key = '{}-{}'.format(prefix, hashlib.sha1(text.encode('utf-8')).hexdigest())
+    value = load_parse(key)
+    if value is None:
+        value = save_parse(key, parse_fn(text))
+    return value
+
+
 def parse_lisp(lisp):
     return pddl_parser.lisp_parser.parse_nested_list(lisp.splitlines())
 
+
+def parse_cached_lisp(lisp):
+    return cached_parse('lisp', lisp, parse_lisp)
+
 Domain = namedtuple(
     'Domain', ['name', 'requirements', 'types', 'type_dict', 'constants',
                'predicates', 'predicate_dict', 'functions', 'actions', 'axioms'])
 
 
 def parse_domain(domain_pddl):
-    return Domain(*parse_domain_pddl(parse_lisp(domain_pddl)))
+    with Phase('parse_domain'):
+        return cached_parse('domain', domain_pddl,
+                            lambda text: Domain(*parse_domain_pddl(parse_lisp(text))))
 
 Problem = namedtuple(
     'Problem', ['task_name', 'task_domain_name', 'task_requirements', 'objects', 'init',
@@ -176,7 +296,8 @@ def task_from_domain_problem(domain, problem):
 
     task = pddl.Task(domain_name, task_name, requirements, types, objects,
                      predicates, functions, init, goal, actions, axioms, use_metric)
-    normalize.normalize(task)
+    with Phase('normalize'):
+        normalize.normalize(task)
     return task
 
 #
@@ -212,54 +333,159 @@ def get_literals(condition):
 #         print('Translate runtime:', time() - t0)
 
 
-def translate_and_write_task(task, temp_dir):
+def translate_task(task, verbose=False):
     # sas_task = pddl_to_sas(instantiate_task(task))
-    normalize.normalize(task)
-    sas_task = translate.pddl_to_sas(task)
+    with Phase('normalize'):
+        normalize.normalize(task)
+    with Phase('translate'):
+        if INCREMENTAL_GROUNDING:
+            sas_task = incremental_pddl_to_sas(task, verbose=verbose)
+        else:
+            sas_task = translate.pddl_to_sas(task)
     # try:
     #    sas_task = translate.pddl_to_sas(task)
     # except AssertionError:
     # raise AssertionError('A function is not defined for some grounding of an
     # action')
     translate.dump_statistics(sas_task)
+    return sas_task
+
+
+def sas_from_task(sas_task):
+    with Phase('serialize'):
+        stream = StringIO()
+        sas_task.output(stream)
+        return stream.getvalue()
+
+
+def translate_and_write_task(task, temp_dir, verbose=False):
+    sas_task = translate_task(task, verbose=verbose)
     clear_dir(temp_dir)
-    with open(os.path.join(temp_dir, TRANSLATE_OUTPUT), "w") as output_file:
-        sas_task.output(output_file)
+    with Phase('write'):
+        with open(os.path.join(temp_dir, TRANSLATE_OUTPUT), "w") as output_file:
+            sas_task.output(output_file)
     return sas_task
 
+#
+
+def str_from_fd(expression):
+    if isinstance(expression, pddl.Literal):
+        return str(expression)
+    if isinstance(expression, pddl.conditions.QuantifiedCondition):
+        return '({} ({}) {})'.format(expression.__class__.__name__, ' '.join(map(str, expression.parameters)),
+                                     ' '.join(map(str_from_fd, expression.parts)))
+    if isinstance(expression, pddl.conditions.Condition):
+        return '({} {})'.format(expression.__class__.__name__, ' '.join(map(str_from_fd, expression.parts)))
+    return str(expression)
+
+
+def str_from_effect(effect):
+    return '({} ({}) {} {})'.format(effect.__class__.__name__, ' '.join(map(str, effect.parameters)),
+                                    str_from_fd(effect.condition), str_from_fd(effect.literal))
+
+
+def str_from_operator(operator):
+    # Actions and axioms
+    parts = [operator.name, str(operator.num_external_parameters), ' '.join(map(str, operator.parameters))]
+    if isinstance(operator, pddl.Action):
+        parts.extend([str_from_fd(operator.precondition), str(operator.cost)])
+        parts.extend(sorted(map(str_from_effect, operator.effects)))
+    else:
+        parts.append(str_from_fd(operator.condition))
+    return ' '.join(parts)
+
+
+def fingerprint_task(task):
+    # Canonical hash of everything in a normalized task that the translator reads
+    parts = [task.domain_name, str(task.requirements), str(task.use_min_cost_metric), str_from_fd(task.goal)]
+    parts.extend(sorted('{} - {}'.format(t.name, t.basetype_name) for t in task.types))
+    parts.extend(sorted(map(str, task.predicates)))
+    parts.extend(sorted(map(str, task.functions)))
+    parts.extend(sorted(map(str, task.objects)))
+    parts.extend(sorted(map(str, task.init)))
+    parts.extend(sorted(map(str_from_operator, task.actions)))
+    parts.extend(sorted(map(str_from_operator, task.axioms)))
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+# sas_task is only retained for tasks small enough to be solved within Python
+Translation = namedtuple('Translation', ['sas_input', 'sas_task', 'sizes', 'solutions'])
+
+TRANSLATION_CACHE = LRUCache(max_size=MAX_CACHE_SIZE, size_fn=lambda t: len(t.sas_input))
+
+
+def make_translation(task, verbose=False):
+    sas_task = translate_task(task, verbose=verbose)
+    return Translation(sas_from_task(sas_task), sas_task if use_python_search(sas_task) else None,
+                       get_sas_sizes(sas_task), {})
+
+
+def get_translation(task, verbose=False):
+    # Skips translation when an identical task was already translated
+    if not CACHE_TRANSLATIONS:
+        return make_translation(task, verbose=verbose)
+    key = fingerprint_task(task)
+    translation = TRANSLATION_CACHE.get(key)
+    if translation is None:
+        translation = TRANSLATION_CACHE.add(key, make_translation(task, verbose=verbose))
+    else:
+        print('Translation cache hit:', TRANSLATION_CACHE)
+        record_cache_hit('translation')
+    return translation
+
 
 def translate_and_write_pddl(domain_pddl, problem_pddl, temp_dir, verbose):
     domain = parse_domain(domain_pddl)
     problem = parse_problem(domain, problem_pddl)
     task = task_from_domain_problem(domain, problem)
     with Verbose(verbose):
-        translate_and_write_task(task, temp_dir)
+        translate_and_write_task(task, temp_dir, verbose=verbose)
 
 #
 
 
-def run_search(temp_dir, planner='max-astar', max_time=INF, max_cost=INF, debug=False):
+def get_search_command(plan_file, planner='max-astar', max_time=INF, max_cost=INF):
     if max_time == INF:
         max_time = 'infinity'
     else:
-        max_time = int(max_time)
+        max_time = int(math.ceil(max_time))
     if max_cost == INF:
         max_cost = 'infinity'
     else:
         max_cost = int(max_cost)
+    planner_config = SEARCH_OPTIONS[planner] % (max_time, max_cost)
+    command = [os.path.join(FD_BIN, SEARCH_BINARY), '--internal-plan-file', plan_file] + \
+              shlex.split(planner_config)
+    timeout = INF if max_time == 'infinity' else (max_time + KILL_GRACE)
+    return command, timeout
+
+
+def extract_plan(output):
+    # Recovers the plan file contents from a search log that also contains it
+    lines = [line for line in output.splitlines()
+             if line.startswith('(') or line.startswith('; cost')]
+    if not lines or not lines[-1].startswith(';'):
+        return None
+    return '\n'.join(lines) + '\n'
+
+
+def run_search(temp_dir, planner='max-astar', max_time=INF, max_cost=INF, debug=False, sas_input=None):
+    in_memory = sas_input is not None
+    plan_file = PLAN_STDOUT if in_memory else (temp_dir + SEARCH_OUTPUT)
+    if not in_memory:
+        sas_input = read(temp_dir + TRANSLATE_OUTPUT)
 
     t0 = time()
-    search = os.path.join("\"%s\"" % FD_BIN, SEARCH_COMMAND)
-    planner_config = SEARCH_OPTIONS[planner] % (max_time, max_cost)
-    command = search % (temp_dir + SEARCH_OUTPUT,
-                        planner_config, temp_dir + TRANSLATE_OUTPUT)
+    command, timeout = get_search_command(plan_file, planner, max_time, max_cost)
     if debug:
-        print('\nSearch command:', command)
-    p = os.popen(command)  # NOTE - cannot pipe input easily with subprocess
-    output = p.read()
+        print('\nSearch command:', ' '.join(command))
+    worker = get_search_pool().search(command, sas_input, timeout=timeout)
+    output = worker.output or ''
     if debug:
         print(output[:-1])
         print('Search runtime:', time() - t0)
+    if in_memory:
+        return extract_plan(output)
     if not os.path.exists(temp_dir + SEARCH_OUTPUT):
         return None
     return read(temp_dir + SEARCH_OUTPUT)
@@ -267,6 +493,41 @@ def run_search(temp_dir, planner='max-astar', max_time=INF, max_cost=INF, debug=
 
 #
 
+def run_portfolio(sas_input, planners, max_time=INF, max_cost=INF, first=True, domain_name=None, debug=False):
+    t0 = time()
+    pool = get_search_pool()
+    worker_from_planner = {}
+    for planner in planners:
+        command, _ = get_search_command(PLAN_STDOUT, planner, max_time, max_cost)
+        worker_from_planner[planner] = pool.start(command, sas_input)
+    if debug:
+        print('\nPortfolio:', ', '.join(planners))
+    deadline = INF if max_time == INF else (t0 + max_time + KILL_GRACE)
+    best_solution, best_cost, best_planner = None, INF, None
+    while worker_from_planner and (time() < deadline):
+        for planner, worker in list(worker_from_planner.items()):
+            if worker.is_running():
+                continue
+            del worker_from_planner[planner]
+            solution = extract_plan(worker.wait() or '')
+            _, cost = parse_solution(solution)
+            if debug:
+                print('Planner: {} | Cost: {} | Runtime: {:.3f}'.format(planner, cost, worker.elapsed_time()))
+            if cost < best_cost:
+                best_solution, best_cost, best_planner = solution, cost, planner
+        if first and (best_solution is not None):
+            break
+        sleep(POLL_PERIOD)
+    for worker in worker_from_planner.values():
+        worker.cancel()
+    if (best_planner is not None) and (domain_name is not None):
+        record_planner_win(domain_name, best_planner, time() - t0)
+    if debug:
+        print('Winner: {} | Portfolio runtime: {:.3f}'.format(best_planner, time() - t0))
+    return best_solution, best_planner
+
+#
+
 def parse_solution(solution):
     # action_regex = r'\((\w+(\s+\w+)\)' # TODO: regex
     cost = INF
@@ -285,7 +546,9 @@ def parse_solution(solution):
     return plan, cost
 
 
-def write_pddl(domain_pddl=None, problem_pddl=None, temp_dir=TEMP_DIR):
+def write_pddl(domain_pddl=None, problem_pddl=None, temp_dir=None):
+    if temp_dir is None:
+        temp_dir = get_temp_dir()
     clear_dir(temp_dir)
     domain_path = os.path.join(temp_dir, DOMAIN_INPUT)
     if domain_pddl is not None:
@@ -298,7 +561,9 @@ def write_pddl(domain_pddl=None, problem_pddl=None, temp_dir=TEMP_DIR):
 #
 
 
-def solve_from_pddl(domain_pddl, problem_pddl, temp_dir=TEMP_DIR, clean=False, debug=False, **kwargs):
+def solve_from_pddl(domain_pddl, problem_pddl, temp_dir=None, clean=False, debug=False, **kwargs):
+    if temp_dir is None:
+        temp_dir = get_temp_dir()
     start_time = time()
     write_pddl(domain_pddl, problem_pddl, temp_dir)
     # run_translate(temp_dir, verbose)
@@ -311,24 +576,135 @@ def solve_from_pddl(domain_pddl, problem_pddl, temp_dir=TEMP_DIR, clean=False, d
     return parse_solution(solution)
 
 
-def solve_from_task(task, temp_dir=TEMP_DIR, clean=False, debug=False, **kwargs):
+def solve_from_task(task, temp_dir=None, clean=False, debug=False, in_memory=None, in_process=None, **kwargs):
+    # The planner may also be a list of configurations to run in parallel
+    if temp_dir is None:
+        temp_dir = get_temp_dir()
+    if in_memory is None:
+        in_memory = IN_MEMORY
+    if in_process is None:
+        in_process = IN_PROCESS
+    planner = kwargs.get('planner', None)
+    if planner == PORTFOLIO_PLANNER:
+        planner = select_planner(task.domain_name, PORTFOLIO) or PORTFOLIO
+        kwargs['planner'] = planner
     start_time = time()
+    start_call(planner)
+    max_time = kwargs.get('max_time', INF)
+    if max_time <= 0:
+        finish_call('timeout')
+        return None, INF
     with Verbose(debug):
-        translate_and_write_task(task, temp_dir)
-        solution = run_search(temp_dir, debug=True, **kwargs)
-        if clean:
-            safe_rm_dir(temp_dir)
+        translation = get_translation(task, verbose=debug)
+        record_sizes(translation.sizes)
+        # Only complete searches are reused because a time limited search might fail
+        search_key = (str(planner), kwargs.get('max_cost', INF))
+        complete = max_time == INF
+        kwargs['max_time'] = max_time - (time() - start_time)
+        if search_key in translation.solutions:
+            solution = translation.solutions[search_key]
+            print('Search cache hit:', search_key)
+            record_cache_hit('search')
+        elif kwargs['max_time'] <= 0:
+            print('Search timeout: translation exceeded the remaining time')
+            solution = None
+        elif in_process and (translation.sas_task is not None) and not isinstance(planner, (list, tuple)):
+            # Launching FastDownward dominates the runtime for small tasks
+            with Phase('search'):
+                solution = python_search(translation.sas_task, debug=True, **kwargs)
+        elif isinstance(planner, (list, tuple)):
+            kwargs.pop('planner')
+            with Phase('search'):
+                solution, _ = run_portfolio(translation.sas_input, planner, domain_name=task.domain_name,
+                                            debug=True, **kwargs)
+        elif in_memory:
+            with Phase('search'):
+                solution = run_search(None, debug=True, sas_input=translation.sas_input, **kwargs)
+        else:
+            clear_dir(temp_dir)
+            with Phase('write'):
+                write(os.path.join(temp_dir, TRANSLATE_OUTPUT), translation.sas_input)
+            with Phase('search'):
+                solution = run_search(temp_dir, debug=True, **kwargs)
+            if clean:
+                safe_rm_dir(temp_dir)
+        if (solution is not None) or complete:
+            translation.solutions[search_key] = solution
         print('Total runtime:', time() - start_time)
-    return parse_solution(solution)
+    plan, cost = parse_solution(solution)
+    if plan is not None:
+        finish_call('solved', cost)
+    elif max_time <= (time() - start_time):
+        finish_call('timeout')
+    else:
+        finish_call('unsolved')
+    return plan, cost
+
+
+def solve_anytime(task, planner='ff-wastar3', max_time=INF, max_cost=INF, max_plans=INF, debug=False,
+                  in_process=None, **kwargs):
+    # Yields successively cheaper (plan, cost) pairs by bounding each search with the previous cost
+    # The remaining solve_from_task keyword args do not apply because the task is always kept in memory
+    # Unless max_plans is reached, the next search runs in the background while the caller processes the current plan
+    # solve_incremental only requests one plan at a time and solve_focused does not support anytime search
+    start_time = time()
+    if in_process is None:
+        in_process = IN_PROCESS
+    start_call(planner)
+    with Verbose(debug):
+        translation = get_translation(task, verbose=debug)
+    sas_task = translation.sas_task if in_process else None
+    pool = get_search_pool()
+    worker = None
+    num_plans = 0
+    try:
+        while (time() - start_time) < max_time:
+            record_sizes(translation.sizes)
+            if sas_task is not None:
+                with Verbose(debug), Phase('search'):
+                    solution = python_search(sas_task, planner, max_time - (time() - start_time),
+                                             max_cost, debug=True)
+            else:
+                if worker is None:
+                    command, timeout = get_search_command(PLAN_STDOUT, planner, max_time - (time() - start_time), max_cost)
+                    worker = pool.start(command, translation.sas_input)
+                with Phase('search'):
+                    solution = extract_plan(worker.wait(timeout) or '')
+                worker = None
+            plan, cost = parse_solution(solution)
+            if (plan is None) or (max_cost <= cost):
+                finish_call('timeout' if max_time <= (time() - start_time) else 'unsolved')
+                break
+            finish_call('solved', cost)
+            max_cost = cost
+            num_plans += 1
+            if (sas_task is None) and (num_plans < max_plans) and ((time() - start_time) < max_time):
+                command, timeout = get_search_command(PLAN_STDOUT, planner, max_time - (time() - start_time), max_cost)
+                worker = pool.start(command, translation.sas_input)
+            if debug:
+                print('Anytime cost: {} | Runtime: {:.3f}'.format(cost, time() - start_time))
+            yield plan, cost
+            if max_plans <= num_plans:
+                break
+            start_call(planner)
+        else:
+            finish_call('timeout')
+    finally:
+        if worker is not None:
+            worker.cancel()
 
 #
 
 
 def conditions_hold(state, conditions):
+    if isinstance(state, BitState):
+        return state.holds(conditions)
     return all((cond in state) != cond.negated for cond in conditions)
 
 
 def is_applicable(state, action):
+    if isinstance(state, BitState) and isinstance(action, pddl.PropositionalAction):
+        return state.is_applicable(action)
     if isinstance(action, pddl.PropositionalAction):
         return conditions_hold(state, action.precondition)
     elif isinstance(action, pddl.PropositionalAxiom):
@@ -338,6 +714,9 @@ def is_applicable(state, action):
 
 def apply_action(state, action):
     assert(isinstance(action, pddl.PropositionalAction))
+    if isinstance(state, BitState):
+        state.apply(action)
+        return
     for conditions, effect in action.del_effects:
         if conditions_hold(state, conditions) and (effect in state):
             state.remove(effect)
@@ -3,6 +3,9 @@ from __future__ import print_function
 from heapq import heappush
 
 from pddlstream.algorithm import parse_problem, SolutionStore, has_costs
+from pddlstream.downward import TempDirectory
+from pddlstream.object import ObjectRegistry
+from pddlstream.report import SolveReport
 from pddlstream.instantiation import Instantiator
 from pddlstream.conversion import revert_solution
 from pddlstream.function import Function, Predicate
@@ -13,9 +16,9 @@ from pddlstream.reorder import separate_plan, reorder_combined_plan, reorder_str
 from pddlstream.scheduling.relaxed import relaxed_stream_plan
 from pddlstream.scheduling.simultaneous import simultaneous_stream_plan, evaluations_from_stream_plan
 from pddlstream.statistics import get_action_info, load_stream_statistics, \
-    write_stream_statistics
+    write_stream_statistics, write_planner_statistics
 from pddlstream.skeleton import optimistic_process_streams, instantiate_first, optimistic_process_stream_plan, \
-    Skeleton, SkeletonKey, greedily_process_queue, fairly_process_queue, get_stream_plan_index
+    OptimisticInstantiator, Skeleton, SkeletonKey, greedily_process_queue, fairly_process_queue, get_stream_plan_index
 from pddlstream.utils import INF, HeapElement
 from pddlstream.visualization import clear_visualizations, create_visualizations
 from pddlstream.incremental import layered_process_stream_queue
@@ -69,17 +72,21 @@ def recursive_solve_stream_plan(evaluations, streams, functions, stream_results,
                                                  functions)
     return recursive_solve_stream_plan(evaluations, streams, functions, stream_results, solve_stream_plan, depth + 1)
 
-def iterative_solve_stream_plan(evaluations, streams, functions, solve_stream_plan):
+def iterative_solve_stream_plan(evaluations, streams, functions, solve_stream_plan, optimistic_instantiator=None,
+                                is_terminated=lambda: False):
     # TODO: option to toggle commit using max_depth?
     # TODO: constrain to use previous plan to some degree
     num_iterations = 0
     while True:
         num_iterations += 1
-        stream_results = optimistic_process_streams(evaluations, streams + functions)
+        if optimistic_instantiator is None:
+            stream_results = optimistic_process_streams(evaluations, streams + functions)
+        else:
+            stream_results = optimistic_instantiator.get_results()
         combined_plan, cost, depth = recursive_solve_stream_plan(evaluations, streams, functions, stream_results, solve_stream_plan, 0)
         print('Attempt: {} | Results: {} | Depth: {} | Success: {}'.format(num_iterations, len(stream_results),
                                                                            depth, combined_plan is not None))
-        if (combined_plan is not None) or (depth == 0):
+        if (combined_plan is not None) or (depth == 0) or is_terminated():
             return combined_plan, cost
 
 ##################################################
@@ -104,58 +111,70 @@ def solve_focused(problem, stream_info={}, action_info={}, synthesizers=[],
         (or None), cost is the cost of the plan, and evaluations is init but expanded
         using stream applications
     """
-    # TODO: return to just using the highest level samplers at the start
-    solve_stream_plan_fn = relaxed_stream_plan if effort_weight is None else simultaneous_stream_plan
-    # TODO: warning check if using simultaneous_stream_plan or sequential_stream_plan with non-eager functions
-    num_iterations = 0
-    store = SolutionStore(max_time, max_cost, verbose) # TODO: include other info here?
-    evaluations, goal_expression, domain, stream_name, externals = parse_problem(problem, stream_info)
-    compile_to_exogenous(evaluations, domain, externals)
-    if unit_costs is None:
-        unit_costs = not has_costs(domain)
-    full_action_info = get_action_info(action_info)
-    load_stream_statistics(stream_name, externals + synthesizers)
-    if visualize:
-        clear_visualizations()
-    eager_externals = list(filter(lambda e: e.info.eager, externals))
-    streams, functions, negative = partition_externals(externals)
-    queue = []
-    # TODO: switch to searching if believe chance of search better than sampling
-    while not store.is_terminated():
-        num_iterations += 1
-        # TODO: decide max_sampling_time based on total search_time or likelihood estimates
-        print('\nIteration: {} | Queue: {} | Evaluations: {} | Cost: {} | Time: {:.3f}'.format(
-            num_iterations, len(queue), len(evaluations), store.best_cost, store.elapsed_time()))
-        layered_process_stream_queue(Instantiator(evaluations, eager_externals), evaluations, store, eager_layers)
-        solve_stream_plan = lambda sr: solve_stream_plan_fn(evaluations, goal_expression, domain, sr,
-                                                            negative,
-                                                            max_cost=store.best_cost,
-                                                            #max_cost=min(store.best_cost, max_cost),
-                                                            unit_costs=unit_costs, **search_kwargs)
-        #combined_plan, cost = solve_stream_plan(populate_results(evaluations, streams + functions))
-        combined_plan, cost = iterative_solve_stream_plan(evaluations, streams, functions, solve_stream_plan)
-        if action_info:
-            combined_plan = reorder_combined_plan(evaluations, combined_plan, full_action_info, domain)
-            print('Combined plan: {}'.format(combined_plan))
-        stream_plan, action_plan = separate_plan(combined_plan, full_action_info)
-        stream_plan = reorder_stream_plan(stream_plan) # TODO: is this strictly redundant?
-        stream_plan = get_synthetic_stream_plan(stream_plan, synthesizers)
-        print('Stream plan: {}\n'
-              'Action plan: {}'.format(stream_plan, action_plan))
+    with TempDirectory(), SolveReport() as report, ObjectRegistry():
+        # TODO: return to just using the highest level samplers at the start
+        solve_stream_plan_fn = relaxed_stream_plan if effort_weight is None else simultaneous_stream_plan
+        # TODO: warning check if using simultaneous_stream_plan or sequential_stream_plan with non-eager functions
+        num_iterations = 0
+        store = SolutionStore(max_time, max_cost, verbose) # TODO: include other info here?
+        evaluations, goal_expression, domain, stream_name, externals = parse_problem(problem, stream_info)
+        compile_to_exogenous(evaluations, domain, externals)
+        if unit_costs is None:
+            unit_costs = not has_costs(domain)
+        full_action_info = get_action_info(action_info)
+        load_stream_statistics(stream_name, externals + synthesizers)
+        if visualize:
+            clear_visualizations()
+        eager_externals = list(filter(lambda e: e.info.eager, externals))
+        streams, functions, negative = partition_externals(externals)
+        # Persist across iterations and only process the newly certified evaluations
+        eager_instantiator = Instantiator(evaluations, eager_externals)
+        optimistic_instantiator = OptimisticInstantiator(evaluations, streams + functions)
+        queue = []
+        # TODO: switch to searching if believe chance of search better than sampling
+        while not store.is_terminated():
+            num_iterations += 1
+            # TODO: decide max_sampling_time based on total search_time or likelihood estimates
+            print('\nIteration: {} | Queue: {} | Evaluations: {} | Cost: {} | Time: {:.3f}'.format(
+                num_iterations, len(queue), len(evaluations), store.best_cost, store.elapsed_time()))
+            eager_instantiator.sync(evaluations)
+            layered_process_stream_queue(eager_instantiator, evaluations, store, eager_layers)
+            solve_stream_plan = lambda sr: solve_stream_plan_fn(evaluations, goal_expression, domain, sr,
+                                                                negative,
+                                                                max_cost=store.best_cost,
+                                                                max_time=store.time_remaining(),
+                                                                #max_cost=min(store.best_cost, max_cost),
+                                                                unit_costs=unit_costs, **search_kwargs)
+            #combined_plan, cost = solve_stream_plan(populate_results(evaluations, streams + functions))
+            combined_plan, cost = iterative_solve_stream_plan(evaluations, streams, functions, solve_stream_plan,
+                                                              optimistic_instantiator, store.is_timeout)
+            if (combined_plan is None) and store.is_timeout():
+                break # The search ran out of time rather than proving that no stream plan exists
+            if action_info:
+                combined_plan = reorder_combined_plan(evaluations, combined_plan, full_action_info, domain)
+                print('Combined plan: {}'.format(combined_plan))
+            stream_plan, action_plan = separate_plan(combined_plan, full_action_info)
+            stream_plan = reorder_stream_plan(stream_plan) # TODO: is this strictly redundant?
+            stream_plan = get_synthetic_stream_plan(stream_plan, synthesizers)
+            print('Stream plan: {}\n'
+                  'Action plan: {}'.format(stream_plan, action_plan))
 
-        if stream_plan is None:
-            if queue:
-                 fairly_process_queue(queue, evaluations, store)
+            if stream_plan is None:
+                if queue:
+                     fairly_process_queue(queue, evaluations, store)
+                else:
+                    break
             else:
-                break
-        else:
-            if visualize:
-                create_visualizations(evaluations, stream_plan, num_iterations)
-            heappush(queue, HeapElement(SkeletonKey(0, len(stream_plan)),
-                             Skeleton(instantiate_first({}, stream_plan), 0, {}, stream_plan, action_plan, cost)))
-            greedily_process_queue(queue, evaluations, store, sampling_time)
+                if visualize:
+                    create_visualizations(evaluations, stream_plan, num_iterations)
+                heappush(queue, HeapElement(SkeletonKey(0, len(stream_plan)),
+                                 Skeleton(instantiate_first({}, stream_plan), 0, {}, stream_plan, action_plan, cost)))
+                greedily_process_queue(queue, evaluations, store, sampling_time)
 
-    if postprocess and (not unit_costs):
-        locally_optimize(evaluations, store, goal_expression, domain, functions, negative, synthesizers)
-    write_stream_statistics(stream_name, externals + synthesizers, verbose)
-    return revert_solution(store.best_plan, store.best_cost, evaluations)
\ No newline at end of file
+        if postprocess and (not unit_costs):
+            locally_optimize(evaluations, store, goal_expression, domain, functions, negative, synthesizers)
+        write_stream_statistics(stream_name, externals + synthesizers, verbose)
+        write_planner_statistics(verbose)
+        if verbose:
+            report.dump()
+        return revert_solution(store.best_plan, store.best_cost, evaluations)
\ No newline at end of file
@@ -1,18 +1,25 @@
+import inspect
 from collections import Counter
 
 from pddlstream.conversion import values_from_objects, substitute_expression, get_prefix, get_args, Equal, Not, is_head, \
     list_from_conjunction, is_parameter, str_from_head
-from pddlstream.utils import str_from_tuple, INF
+from pddlstream.utils import str_from_tuple, INF, elapsed_time, SupervisedCall
+from pddlstream.memo import get_result_memo
 from pddlstream.object import Object
 import time
 
 DEBUG = 'debug'
 
 class ExternalInfo(object):
-    def __init__(self, eager, p_success, overhead):
+    def __init__(self, eager, p_success, overhead, batch_size=None, version=None,
+                 timeout=None, disable_on_timeout=False):
         self.eager = eager
         self.p_success = p_success
         self.overhead = overhead
+        self.batch_size = batch_size # Maximum number of input tuples per batch_fn call (None is unbounded)
+        self.version = version # Change to invalidate the outputs stored in a ResultMemo
+        self.timeout = timeout # Seconds to wait for a single call before counting it as a failure
+        self.disable_on_timeout = disable_on_timeout # Never calls an instance again after a timeout
 
 def geometric_cost(cost, p):
     if p == 0:
@@ -20,11 +27,29 @@ def geometric_cost(cost, p):
     return cost/p
 
 class FunctionInfo(ExternalInfo):
-    def __init__(self, opt_fn=None, eager=False, p_success=None, overhead=None):
-        super(FunctionInfo, self).__init__(eager, p_success, overhead)
+    def __init__(self, opt_fn=None, eager=False, p_success=None, overhead=None, batch_size=None, version=None,
+                 timeout=None, disable_on_timeout=False):
+        super(FunctionInfo, self).__init__(eager, p_success, overhead, batch_size, version,
+                                           timeout, disable_on_timeout)
         self.opt_fn = opt_fn
         #self.order = 0
 
+def is_coroutine_fn(fn):
+    return getattr(inspect, 'iscoroutinefunction', lambda f: False)(fn) # Python 3
+
+def is_async_gen_fn(fn):
+    return getattr(inspect, 'isasyncgenfunction', lambda f: False)(fn) # Python 3.6
+
+class BatchFn(object):
+    """
+    Wraps batch_fn(list of input tuples) -> list of outputs (one per input tuple)
+    Calling it on a single input tuple evaluates a batch of size one
+    """
+    def __init__(self, batch_fn):
+        self.batch_fn = batch_fn
+    def __call__(self, *input_values):
+        return self.batch_fn([input_values])[0]
+
 ##################################################
 
 class Performance(object):
@@ -88,7 +113,10 @@ class Instance(object):
         self.total_calls = 0
         self.total_overhead = 0
         self.total_successes = 0
+        self.num_timeouts = 0
         self.results_history = []
+        self._pending = None # SupervisedCall that exceeded its timeout
+        self._exhausted = False # Set by _next_outputs (possibly on another thread) and applied by _process_outputs
         self.mapping = dict(zip(self.external.inputs, self.input_objects))
         for constant in self.external.constants:
             self.mapping[constant] = Object.from_name(constant)
@@ -125,6 +153,59 @@ class Instance(object):
     def get_domain(self):
         return self.domain
 
+    def _get_state(self):
+        # State needed to resume the external after the current call (None if it cannot be stored)
+        return None
+
+    def _skip_outputs(self, num_calls, state=None):
+        pass
+
+    def _next_supervised_outputs(self):
+        # Returns None if the call exceeds the timeout, leaving it pending for the next call
+        # Async generators are bound to the event loop of the calling thread, so they are not supervised
+        timeout = None if self.external.is_async else self.external.info.timeout
+        if (timeout is None) and (self._pending is None):
+            return self._next_outputs()
+        if self._pending is None:
+            self._pending = SupervisedCall(self._next_outputs)
+        if not self._pending.wait(timeout):
+            return None
+        call, self._pending = self._pending, None
+        return call.get()
+
+    def _next_memo_outputs(self, start_time):
+        # Consults the active ResultMemo (if any) before calling the external
+        # Returns the outputs and the start time to record, which a hit moves back by the original overhead
+        memo = get_result_memo()
+        key = None if (memo is None) or self.num_timeouts else memo.get_key(self)
+        if key is None:
+            # Call indices are no longer reproducible after a timeout
+            return self._next_supervised_outputs(), start_time
+        entry = memo.lookup(key)
+        if entry is not None:
+            outputs, self._exhausted, overhead = entry
+            return outputs, time.time() - overhead
+        if self.total_calls:
+            previous_key = key[:-1] + (self.total_calls - 1,)
+            self._skip_outputs(self.total_calls, memo.lookup_state(previous_key))
+        if self._exhausted:
+            return [], start_time
+        call_time = time.time()
+        outputs = self._next_supervised_outputs()
+        if outputs is not None:
+            memo.store(key, outputs, self._exhausted, elapsed_time(call_time), self._get_state())
+        return outputs, start_time
+
+    def _timeout_results(self, start_time, verbose=False):
+        self.num_timeouts += 1
+        if verbose:
+            print('{}:{} timed out after {:.3f} seconds'.format(
+                self.external.name, str_from_tuple(self.get_input_values()), elapsed_time(start_time)))
+        if self.external.info.disable_on_timeout:
+            self.enumerated = True
+        self.update_statistics(start_time, [])
+        return []
+
     def next_results(self, verbose=False):
         raise NotImplementedError()
 
@@ -142,6 +223,14 @@ class External(Performance):
         self.domain = tuple(domain)
         self.constants = {a for i in domain for a in get_args(i) if not is_parameter(a)}
         self.instances = {}
+        self.batch_fn = None
+        self.is_async = False # Evaluated on an event loop (see asynchronous.py)
+        self.is_generator = False
+
+    def get_batch_size(self):
+        if self.info.batch_size is None:
+            return INF
+        return self.info.batch_size
 
     def get_instance(self, input_objects):
         input_objects = tuple(input_objects)
@@ -175,15 +264,25 @@ class FunctionInstance(Instance):  # Head(Instance):
     def get_head(self):
         return substitute_expression(self.external.head, self.get_mapping())
 
-    def next_results(self, verbose=False):
-        start_time = time.time()
-        assert not self.enumerated
-        self.enumerated = True
+    def _from_batch_output(self, value):
+        return value
+
+    def _next_outputs(self):
+        if self.external.is_async:
+            from pddlstream.asynchronous import run_next_outputs
+            return run_next_outputs(self)
         input_values = self.get_input_values()
         try:
             value = self.external.fn(*input_values)
         except TypeError:
             raise TypeError('Function [{}] expects {} inputs'.format(self.external.name, len(input_values)))
+        self._exhausted = True
+        return value
+
+    def _process_outputs(self, value, start_time, verbose=False):
+        # Only called once the call has returned (a timed out call remains pending)
+        self.enumerated = True
+        input_values = self.get_input_values()
         self.value = self.external._codomain(value)
         # TODO: cast the inputs and test whether still equal?
         #if not (type(self.value) is self.external._codomain):
@@ -205,6 +304,14 @@ class FunctionInstance(Instance):  # Head(Instance):
             self.update_statistics(start_time, results)
         return results
 
+    def next_results(self, verbose=False):
+        start_time = time.time()
+        assert not self.enumerated
+        value, start_time = self._next_memo_outputs(start_time)
+        if value is None:
+            return self._timeout_results(start_time, verbose=verbose)
+        return self._process_outputs(value, start_time, verbose=verbose)
+
     def next_optimistic(self):
         if self.enumerated or self.disabled:
             return []
@@ -231,6 +338,9 @@ class Function(External):
             info = FunctionInfo(p_success=self._default_p_success, overhead=self._default_overhead)
         super(Function, self).__init__(get_prefix(head), info, get_args(head), domain)
         self.head = head
+        if isinstance(fn, BatchFn):
+            self.batch_fn = fn.batch_fn
+        self.is_async = is_coroutine_fn(fn)
         opt_fn = lambda *args: self._codomain()
         if fn == DEBUG:
             fn = opt_fn
@@ -275,6 +385,25 @@ class Predicate(Function):
 
 ##################################################
 
+def next_batch_results(instances, verbose=False):
+    # Evaluates instances of the same batched external with a single call, splitting the overhead evenly
+    external = instances[0].external
+    start_time = time.time()
+    outputs = external.batch_fn([instance.get_input_values() for instance in instances])
+    if len(outputs) != len(instances):
+        raise ValueError('Batch function [{}] produced {} outputs for {} inputs'.format(
+            external.name, len(outputs), len(instances)))
+    overhead = elapsed_time(start_time) / len(instances)
+    results = []
+    for instance, output in zip(instances, outputs):
+        assert not instance.enumerated
+        instance._exhausted = True
+        results.append(instance._process_outputs(instance._from_batch_output(output),
+                                                 time.time() - overhead, verbose=verbose))
+    return results
+
+##################################################
+
 def parse_common(lisp_list, stream_map, stream_info):
     assert (2 <= len(lisp_list) <= 3)
     head = tuple(lisp_list[1])
@@ -0,0 +1,116 @@
+from __future__ import print_function
+
+import threading
+
+from pddlstream.utils import LRUCache
+
+MAX_MODELS = 4
+
+
+def fact_key(atom):
+    return (atom.predicate,) + tuple(atom.args)
+
+
+def rules_key(prog):
+    # The goal rule (@goal-reachable) and any action or axiom rules that differ change the key
+    return tuple(map(str, prog.rules))
+
+
+class IncrementalModel(object):
+    """
+    Relaxed reachability model (as computed by build_model.compute_model) that is
+    extended with newly added facts instead of being recomputed from scratch
+    Relaxed reachability is monotonic, so the rule indices and queue remain valid
+    """
+    def __init__(self, task, prog):
+        import build_model
+        self.actions = tuple(task.actions)
+        self.axioms = tuple(task.axioms)
+        self.rules_key = rules_key(prog)
+        self.rules = build_model.convert_rules(prog)
+        self.unifier = build_model.Unifier(self.rules)
+        self.queue = build_model.Queue([])
+        self.facts = set()
+        self.num_extensions = 0
+
+    def is_compatible(self, task, key, facts):
+        # Action atoms in the model refer to the actions by identity
+        return (len(self.actions) == len(task.actions)) and (len(self.axioms) == len(task.axioms)) and \
+               all(a1 is a2 for a1, a2 in zip(self.actions, task.actions)) and \
+               all(a1 is a2 for a1, a2 in zip(self.axioms, task.axioms)) and \
+               (self.rules_key == key) and (self.facts <= facts)
+
+    def extend(self, prog, verbose=False):
+        new_atoms = [fact.atom for fact in prog.facts if fact_key(fact.atom) not in self.facts]
+        for atom in sorted(new_atoms):
+            self.facts.add(fact_key(atom))
+            self.queue.push(atom.predicate, atom.args)
+        while self.queue:
+            next_atom = self.queue.pop()
+            for rule, cond_index in self.unifier.unify(next_atom):
+                rule.update_index(next_atom, cond_index)
+                rule.fire(next_atom, cond_index, self.queue.push)
+        self.num_extensions += 1
+        if verbose:
+            print('Incremental model: {} new facts | {} atoms | {} extensions'.format(
+                len(new_atoms), len(self.queue.queue), self.num_extensions))
+        return self.queue.queue
+
+##################################################
+
+# Models are extended in place, so each thread keeps its own cache
+_local = threading.local()
+_install_lock = threading.Lock()
+_original_explore = None
+
+
+def get_model_cache():
+    if getattr(_local, 'cache', None) is None:
+        _local.cache = LRUCache(max_size=MAX_MODELS)
+    return _local.cache
+
+
+def get_model(task, prog, verbose=False):
+    cache = get_model_cache()
+    key = rules_key(prog)
+    facts = {fact_key(fact.atom) for fact in prog.facts}
+    for model_id, model in list(cache.entries.items()):
+        if model.is_compatible(task, key, facts):
+            cache.get(model_id)
+            return model.extend(prog, verbose=verbose)
+    model = IncrementalModel(task, prog)
+    cache.add(id(model), model)
+    return model.extend(prog, verbose=verbose)
+
+
+def explore(task):
+    # Mirrors instantiate.explore but only within incremental_pddl_to_sas on the current thread
+    if not getattr(_local, 'active', False):
+        return _original_explore(task)
+    import pddl_to_prolog
+    import instantiate
+    import timers
+    prog = pddl_to_prolog.translate(task)
+    model = get_model(task, prog, verbose=_local.verbose)
+    with timers.timing("Completing instantiation"):
+        return instantiate.instantiate(task, model)
+
+
+def install_explore():
+    # instantiate.explore is replaced once by a dispatcher rather than swapped around each call
+    global _original_explore
+    import instantiate
+    with _install_lock:
+        if instantiate.explore is not explore:
+            _original_explore = instantiate.explore
+            instantiate.explore = explore
+
+
+def incremental_pddl_to_sas(task, verbose=False):
+    import translate
+    install_explore()
+    _local.active, _local.verbose = True, verbose
+    try:
+        return translate.pddl_to_sas(task)
+    finally:
+        _local.active = False
@@ -2,106 +2,223 @@ import time
 
 from pddlstream.algorithm import parse_problem, SolutionStore, add_certified
 from pddlstream.conversion import revert_solution
+from pddlstream.downward import TempDirectory
+from pddlstream.object import ObjectRegistry
+from pddlstream.report import SolveReport
 from pddlstream.exogenous import compile_to_exogenous
-from pddlstream.function import FunctionInstance
-from pddlstream.instantiation import Instantiator
+from pddlstream.function import FunctionInstance, next_batch_results
+from pddlstream.instantiation import Instantiator, FIFO
+from pddlstream.parallel import StreamExecutor
+from pddlstream.statistics import write_planner_statistics
 from pddlstream.utils import elapsed_time
-from pddlstream.algorithm import solve_finite
+from pddlstream.algorithm import solve_finite, solve_finite_anytime
 from pddlstream.utils import INF
 
-def process_stream_queue(instantiator, evaluations, verbose=True):
-    stream_instance = instantiator.stream_queue.popleft()
-    if stream_instance.enumerated:
-        return
-    for result in stream_instance.next_results(verbose=verbose):
+def add_stream_results(instantiator, evaluations, stream_instance, results):
+    depth = instantiator.get_depth(stream_instance) + 1
+    for result in results:
         for evaluation in add_certified(evaluations, result):
-            instantiator.add_atom(evaluation)
+            instantiator.add_atom(evaluation, depth)
     if not stream_instance.enumerated:
         instantiator.stream_queue.append(stream_instance)
 
+def process_stream_instance(instantiator, evaluations, stream_instance, verbose=True):
+    if stream_instance.enumerated:
+        return
+    add_stream_results(instantiator, evaluations, stream_instance, stream_instance.next_results(verbose=verbose))
+
+def get_batches(stream_instances):
+    # Groups the instances of each batched external (up to its batch_size) in order of first occurrence
+    batches = []
+    batch_from_external = {}
+    for stream_instance in stream_instances:
+        external = stream_instance.external
+        if external.batch_fn is None:
+            batches.append([stream_instance])
+            continue
+        batch = batch_from_external.get(external, None)
+        if (batch is None) or (external.get_batch_size() <= len(batch)):
+            batch = []
+            batches.append(batch)
+            batch_from_external[external] = batch
+        batch.append(stream_instance)
+    return batches
+
+def process_stream_batch(instantiator, evaluations, stream_instances, verbose=True):
+    stream_instances = [i for i in stream_instances if not i.enumerated]
+    if not stream_instances:
+        return
+    if stream_instances[0].external.batch_fn is None:
+        for stream_instance in stream_instances:
+            process_stream_instance(instantiator, evaluations, stream_instance, verbose=verbose)
+        return
+    for stream_instance, results in zip(stream_instances, next_batch_results(stream_instances, verbose=verbose)):
+        add_stream_results(instantiator, evaluations, stream_instance, results)
+
+def process_stream_instances(executor, instantiator, evaluations, stream_instances, verbose=True,
+                             is_terminated=lambda: False):
+    # Instances that are not submitted before termination are returned to the queue
+    # Batched externals are evaluated in the main thread as they are already vectorized
+    stream_instances = [i for i in stream_instances if not i.enumerated]
+    for batch in get_batches(i for i in stream_instances if i.external.batch_fn is not None):
+        if is_terminated():
+            break
+        process_stream_batch(instantiator, evaluations, batch, verbose=verbose)
+    stream_instances = iter([i for i in stream_instances if not i.enumerated])
+    for stream_instance, results in executor.imap(stream_instances, verbose=verbose, is_terminated=is_terminated):
+        add_stream_results(instantiator, evaluations, stream_instance, results)
+    for stream_instance in stream_instances:
+        instantiator.stream_queue.append(stream_instance)
+
+def process_stream_queue(instantiator, evaluations, verbose=True):
+    # Returns the number of instances popped from the queue
+    stream_instance = instantiator.stream_queue.popleft()
+    external = stream_instance.external
+    stream_instances = [stream_instance]
+    if (external.batch_fn is not None) and not stream_instance.enumerated:
+        stream_instances += instantiator.stream_queue.pop_all(
+            lambda i: (i.external is external) and not i.enumerated, max_count=external.get_batch_size() - 1)
+    process_stream_batch(instantiator, evaluations, stream_instances, verbose=verbose)
+    return len(stream_instances)
+
 ##################################################
 
-def solve_current(problem, **search_kwargs):
+def solve_current(problem, verbose=True, **search_kwargs):
     """
     Solves a PDDLStream problem without applying any streams
     Will fail if the problem requires stream applications
     :param problem: a PDDLStream problem
+    :param verbose: if True, this prints where planner statistics are written
     :param search_kwargs: keyword args for the search subroutine
     :return: a tuple (plan, cost, evaluations) where plan is a sequence of actions
         (or None), cost is the cost of the plan, and evaluations is init but expanded
         using stream applications
     """
-    evaluations, goal_expression, domain, stream_name, externals = parse_problem(problem)
-    compile_to_exogenous(evaluations, domain, externals)
-    plan, cost = solve_finite(evaluations, goal_expression, domain, **search_kwargs)
-    return revert_solution(plan, cost, evaluations)
+    with TempDirectory(), SolveReport(), ObjectRegistry():
+        evaluations, goal_expression, domain, stream_name, externals = parse_problem(problem)
+        compile_to_exogenous(evaluations, domain, externals)
+        plan, cost = solve_finite(evaluations, goal_expression, domain, **search_kwargs)
+        write_planner_statistics(verbose)
+        return revert_solution(plan, cost, evaluations)
 
 ##################################################
 
-def solve_exhaustive(problem, max_time=300, verbose=True, **search_kwargs):
+def solve_exhaustive(problem, max_time=300, order=FIFO, parallel=None, max_workers=None, deterministic=True,
+                     verbose=True, **search_kwargs):
     """
     Solves a PDDLStream problem by applying all possible streams and searching once
     Requires a finite max_time when infinitely many stream instances
     :param problem: a PDDLStream problem
     :param max_time: the maximum amount of time to apply streams
+    :param order: the order in which stream instances are applied (FIFO, EFFORT, DEPTH, PRIORITY or a function)
+    :param parallel: None (serial), THREADS, PROCESSES or ASYNCIO to evaluate stream instances concurrently
+    :param max_workers: the number of parallel workers or outstanding async calls (defaults to the number of cpus)
+    :param deterministic: if True, parallel results are added in the same order as serial evaluation
     :param verbose: if True, this prints the result of each stream application
     :param search_kwargs: keyword args for the search subroutine
     :return: a tuple (plan, cost, evaluations) where plan is a sequence of actions
         (or None), cost is the cost of the plan, and evaluations is init but expanded
         using stream applications
     """
-    start_time = time.time()
-    evaluations, goal_expression, domain, stream_name, externals = parse_problem(problem)
-    compile_to_exogenous(evaluations, domain, externals)
-    instantiator = Instantiator(evaluations, externals)
-    while instantiator.stream_queue and (elapsed_time(start_time) < max_time):
-        process_stream_queue(instantiator, evaluations, verbose=verbose)
-    plan, cost = solve_finite(evaluations, goal_expression, domain, **search_kwargs)
-    return revert_solution(plan, cost, evaluations)
+    with TempDirectory(), SolveReport(), ObjectRegistry():
+        start_time = time.time()
+        evaluations, goal_expression, domain, stream_name, externals = parse_problem(problem)
+        compile_to_exogenous(evaluations, domain, externals)
+        instantiator = Instantiator(evaluations, externals, order=order)
+        is_terminated = lambda: max_time <= elapsed_time(start_time)
+        with StreamExecutor(externals, parallel, max_workers, deterministic) as executor:
+            while instantiator.stream_queue and not is_terminated():
+                if executor.pool is None:
+                    process_stream_queue(instantiator, evaluations, verbose=verbose)
+                else:
+                    process_stream_instances(executor, instantiator, evaluations, instantiator.stream_queue.pop_all(),
+                                             verbose=verbose, is_terminated=is_terminated)
+        plan, cost = solve_finite(evaluations, goal_expression, domain, **search_kwargs)
+        write_planner_statistics(verbose)
+        return revert_solution(plan, cost, evaluations)
 
 ##################################################
 
-def function_process_stream_queue(instantiator, evaluations, store):
-    for _ in range(len(instantiator.stream_queue)):
-        if isinstance(instantiator.stream_queue[0], FunctionInstance):
-            process_stream_queue(instantiator, evaluations, verbose=store.verbose)
-        else:
-            instantiator.stream_queue.rotate(-1)
+def anytime_search(evaluations, goal_expression, domain, store, **search_kwargs):
+    # Searches for a single plan that is cheaper than the best plan so far (no search continues in the background)
+    max_cost = min(search_kwargs.pop('max_cost', INF), store.best_cost)
+    plans = solve_finite_anytime(evaluations, goal_expression, domain, max_time=store.time_remaining(),
+                                 max_cost=max_cost, max_plans=1, **search_kwargs)
+    try:
+        for plan, cost in plans:
+            store.add_plan(plan, cost)
+            if store.verbose:
+                print('Anytime plan | Cost: {} | Time: {:.3f}'.format(cost, store.elapsed_time()))
+    finally:
+        plans.close()
 
-def layered_process_stream_queue(instantiator, evaluations, store, num_layers):
+def function_process_stream_queue(instantiator, evaluations, store, executor=None):
+    function_instances = instantiator.stream_queue.pop_all(lambda i: isinstance(i, FunctionInstance))
+    if (executor is not None) and (executor.pool is not None):
+        process_stream_instances(executor, instantiator, evaluations, function_instances, verbose=store.verbose)
+        return
+    for batch in get_batches(function_instances):
+        process_stream_batch(instantiator, evaluations, batch, verbose=store.verbose)
+
+def layered_process_stream_queue(instantiator, evaluations, store, num_layers, executor=None):
     # TODO: priority queue and iteratively increase max stream max or add effort
     for _ in range(num_layers):
-        for _ in range(len(instantiator.stream_queue)):
+        if (executor is not None) and (executor.pool is not None):
+            if store.is_terminated():
+                return
+            process_stream_instances(executor, instantiator, evaluations, instantiator.stream_queue.pop_all(),
+                                     verbose=store.verbose, is_terminated=store.is_terminated)
+            continue
+        num_instances = len(instantiator.stream_queue)
+        while (0 < num_instances) and instantiator.stream_queue:
             if store.is_terminated():
                 return
-            process_stream_queue(instantiator, evaluations, verbose=store.verbose)
+            num_instances -= process_stream_queue(instantiator, evaluations, verbose=store.verbose)
 
-def solve_incremental(problem, max_time=INF, max_cost=INF, layers=1, verbose=True, **search_kwargs):
+def solve_incremental(problem, max_time=INF, max_cost=INF, layers=1, anytime=False, order=FIFO,
+                      parallel=None, max_workers=None, deterministic=True, verbose=True, **search_kwargs):
     """
     Solves a PDDLStream problem by alternating between applying all possible streams and searching
     :param problem: a PDDLStream problem
     :param max_time: the maximum amount of time to apply streams
     :param max_cost: a strict upper bound on plan cost
     :param layers: the number of stream application layers per iteration
+    :param anytime: if True, each search only returns a plan cheaper than the best plan so far
+        (a single plan per iteration, so this only differs once a plan that is not below max_cost is found)
+    :param order: the order in which stream instances are applied (FIFO, EFFORT, DEPTH, PRIORITY or a function)
+    :param parallel: None (serial), THREADS, PROCESSES or ASYNCIO to evaluate stream instances concurrently
+    :param max_workers: the number of parallel workers or outstanding async calls (defaults to the number of cpus)
+    :param deterministic: if True, parallel results are added in the same order as serial evaluation
     :param verbose: if True, this prints the result of each stream application
     :param search_kwargs: keyword args for the search subroutine
     :return: a tuple (plan, cost, evaluations) where plan is a sequence of actions
         (or None), cost is the cost of the plan, and evaluations is init but expanded
         using stream applications
     """
-    store = SolutionStore(max_time, max_cost, verbose) # TODO: include other info here?
-    evaluations, goal_expression, domain, _, externals = parse_problem(problem)
-    compile_to_exogenous(evaluations, domain, externals)
-    instantiator = Instantiator(evaluations, externals)
-    num_iterations = 0
-    while not store.is_terminated():
-        num_iterations += 1
-        print('Iteration: {} | Evaluations: {} | Cost: {} | Time: {:.3f}'.format(
-            num_iterations, len(evaluations), store.best_cost, store.elapsed_time()))
-        function_process_stream_queue(instantiator, evaluations, store)
-        plan, cost = solve_finite(evaluations, goal_expression, domain, **search_kwargs)
-        store.add_plan(plan, cost)
-        if not instantiator.stream_queue:
-            break
-        layered_process_stream_queue(instantiator, evaluations, store, layers)
-    return revert_solution(store.best_plan, store.best_cost, evaluations)
+    with TempDirectory(), SolveReport() as report, ObjectRegistry():
+        store = SolutionStore(max_time, max_cost, verbose) # TODO: include other info here?
+        evaluations, goal_expression, domain, _, externals = parse_problem(problem)
+        compile_to_exogenous(evaluations, domain, externals)
+        instantiator = Instantiator(evaluations, externals, order=order)
+        num_iterations = 0
+        with StreamExecutor(externals, parallel, max_workers, deterministic) as executor:
+            while not store.is_terminated():
+                num_iterations += 1
+                print('Iteration: {} | Evaluations: {} | Cost: {} | Time: {:.3f}'.format(
+                    num_iterations, len(evaluations), store.best_cost, store.elapsed_time()))
+                function_process_stream_queue(instantiator, evaluations, store, executor)
+                if store.is_timeout():
+                    break # A search without time remaining returns None as if the problem were unsolvable
+                if anytime:
+                    anytime_search(evaluations, goal_expression, domain, store, **search_kwargs)
+                else:
+                    plan, cost = solve_finite(evaluations, goal_expression, domain,
+                                              max_time=store.time_remaining(), **search_kwargs)
+                    store.add_plan(plan, cost)
+                if not instantiator.stream_queue:
+                    break
+                layered_process_stream_queue(instantiator, evaluations, store, layers, executor)
+        write_planner_statistics(verbose)
+        if verbose:
+            report.dump()
+        return revert_solution(store.best_plan, store.best_cost, evaluations)
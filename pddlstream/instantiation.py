@@ -1,8 +1,16 @@
 from collections import deque, defaultdict
-from itertools import product
+from heapq import heappush, heappop, heapify
+from itertools import count, islice
 
 from pddlstream.conversion import get_prefix, get_args, is_atom, head_from_fact
 from pddlstream.object import Object
+from pddlstream.utils import INF
+
+FIFO = 'fifo'
+EFFORT = 'effort' # Learned overhead / p_success
+DEPTH = 'depth' # Number of stream applications needed to instantiate
+PRIORITY = 'priority' # Only StreamInfo.priority
+ORDERS = (FIFO, EFFORT, DEPTH, PRIORITY)
 
 
 def get_mapping(atoms1, atoms2, initial={}):
@@ -19,20 +27,118 @@ def get_mapping(atoms1, atoms2, initial={}):
     return mapping
 
 
+def extend_mapping(mapping, params, args):
+    # Binds the parameters (and checks the constants) of a domain atom to the args of a matching head
+    new_mapping = mapping.copy()
+    for param, arg in zip(params, args):
+        if isinstance(param, Object):
+            if param != arg:
+                return None
+        elif new_mapping.setdefault(param, arg) != arg:
+            return None
+    return new_mapping
+
+
+class StreamQueue(object):
+    """
+    Queue of stream instances that is a FIFO deque unless given a priority_fn
+    Otherwise, instances are popped in layers: those (re)appended after a layer starts wait for the next layer
+    Within a layer, instances with smaller priorities are popped first, breaking ties in FIFO order
+    """
+    def __init__(self, priority_fn=None):
+        self.priority_fn = priority_fn
+        self.queue = deque() if priority_fn is None else []
+        self.counter = count()
+        self.generation = 0
+    def _next_generation(self):
+        # Priorities (for instance, EFFORT) are recomputed as statistics change between layers
+        self.generation += 1
+        self.queue = [(generation, self.priority_fn(stream_instance), index, stream_instance)
+                      for generation, _, index, stream_instance in self.queue]
+        heapify(self.queue)
+    def append(self, stream_instance):
+        if self.priority_fn is None:
+            self.queue.append(stream_instance)
+        else:
+            heappush(self.queue, (self.generation, self.priority_fn(stream_instance),
+                                  next(self.counter), stream_instance))
+    def popleft(self):
+        if self.priority_fn is None:
+            return self.queue.popleft()
+        if self.queue[0][0] == self.generation:
+            self._next_generation()
+        return heappop(self.queue)[-1]
+    def peek(self):
+        if self.priority_fn is None:
+            return self.queue[0]
+        return self.queue[0][-1]
+    def pop_all(self, test=lambda i: True, max_count=INF):
+        # Removes and returns (up to max_count of) the instances that satisfy test in popping order
+        if self.priority_fn is None:
+            entries = list(self.queue)
+        else:
+            if self.queue and (self.queue[0][0] == self.generation):
+                self._next_generation()
+            entries = sorted(self.queue)
+        stream_instances = []
+        remaining = []
+        for entry in entries:
+            stream_instance = entry if self.priority_fn is None else entry[-1]
+            if (len(stream_instances) < max_count) and test(stream_instance):
+                stream_instances.append(stream_instance)
+            else:
+                remaining.append(entry)
+        self.queue = deque(remaining) if self.priority_fn is None else remaining # A sorted list is a heap
+        return stream_instances
+    def reprioritize(self, priority_fn=None):
+        # Recomputes the priorities (for instance after statistics or StreamInfo.priority change)
+        stream_instances = list(self)
+        if priority_fn is not None:
+            self.priority_fn = priority_fn
+        self.queue = deque() if self.priority_fn is None else []
+        for stream_instance in stream_instances:
+            self.append(stream_instance)
+    def __iter__(self):
+        if self.priority_fn is None:
+            return iter(list(self.queue))
+        return iter([entry[-1] for entry in sorted(self.queue)])
+    def __len__(self):
+        return len(self.queue)
+    def __nonzero__(self):
+        return bool(self.queue)
+    __bool__ = __nonzero__
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, list(self))
+
+##################################################
+
 class Instantiator(object): # Dynamic Stream Instantiator
-    def __init__(self, evaluations, streams):
+    def __init__(self, evaluations, streams, order=FIFO):
         # TODO: filter eager
         #self.streams_from_atom = defaultdict(list)
         self.streams = streams
         self.stream_instances = set()
-        self.stream_queue = deque()
+        self.depth_from_instance = {}
+        self.depth_from_head = {}
+        self.stream_queue = StreamQueue(self._get_priority_fn(order))
         self.atoms = set()
         self.atoms_from_domain = defaultdict(list)
+        self.indices_from_domain = defaultdict(dict)
+        self.position_from_domain = defaultdict(dict) # Order in which each atom was added to atoms_from_domain
+        self.join_orders = {}
+        self.num_synced = 0
         for stream in self.streams:
             if not stream.inputs:
                 self._add_instance(stream, tuple())
-        for atom in evaluations:
+        self.sync(evaluations)
+
+    def sync(self, evaluations):
+        # Adds the evaluations appended to an insertion-ordered evaluations since the last sync
+        new_evaluations = list(islice(evaluations, self.num_synced, None))
+        self.num_synced = len(evaluations)
+        for atom in new_evaluations:
             self.add_atom(atom)
+        return new_evaluations
 
     #def __next__(self):
     #    pass
@@ -43,21 +149,103 @@ class Instantiator(object): # Dynamic Stream Instantiator
     #        # TODO: remove from set?
     #        yield stream_instance
 
-    def _add_instance(self, stream, input_objects):
+    def _get_priority_fn(self, order):
+        if callable(order):
+            return order
+        if order not in ORDERS:
+            raise ValueError('Unknown stream order: {}'.format(order))
+        if order == FIFO:
+            return None
+        def priority_fn(stream_instance):
+            priority = getattr(stream_instance.external.info, 'priority', None)
+            key = (0 if priority is None else priority,)
+            if order == EFFORT:
+                key += (stream_instance.get_effort(),)
+            elif order == DEPTH:
+                key += (self.depth_from_instance.get(stream_instance, 0),)
+            return key
+        return priority_fn
+
+    def set_order(self, order):
+        self.stream_queue.reprioritize(self._get_priority_fn(order))
+
+    def get_depth(self, stream_instance):
+        return self.depth_from_instance.get(stream_instance, 0)
+
+    def _add_instance(self, stream, input_objects, depth=0):
         stream_instance = stream.get_instance(input_objects)
         if stream_instance in self.stream_instances:
             return False
         self.stream_instances.add(stream_instance)
+        self.depth_from_instance[stream_instance] = depth
         self.stream_queue.append(stream_instance)
         return True
 
-    def add_atom(self, atom):
+    def _get_join_order(self, i, j):
+        # Greedily joins the domain atom that shares the most parameters with those already bound
+        key = (i, j)
+        if key not in self.join_orders:
+            domain = self.streams[i].domain
+            bound = {a for a in get_args(domain[j]) if not isinstance(a, Object)}
+            remaining = set(range(len(domain))) - {j}
+            order = []
+            while remaining:
+                k = max(sorted(remaining), key=lambda k: sum(a in bound for a in get_args(domain[k])))
+                remaining.remove(k)
+                positions = tuple(p for p, a in enumerate(get_args(domain[k])) if a in bound)
+                order.append((k, positions))
+                bound.update(a for a in get_args(domain[k]) if not isinstance(a, Object))
+            self.join_orders[key] = order
+        return self.join_orders[key]
+
+    def _get_index(self, i, k, positions):
+        # Hash index from the values at the bound positions to the atoms of domain atom k
+        indices = self.indices_from_domain[(i, k)]
+        if positions not in indices:
+            index = defaultdict(list)
+            for head in self.atoms_from_domain[(i, k)]:
+                index[tuple(head.args[p] for p in positions)].append(head)
+            indices[positions] = index
+        return indices[positions]
+
+    def _add_domain_atom(self, i, k, head):
+        self.position_from_domain[(i, k)][head] = len(self.atoms_from_domain[(i, k)])
+        self.atoms_from_domain[(i, k)].append(head)
+        for positions, index in self.indices_from_domain[(i, k)].items():
+            index[tuple(head.args[p] for p in positions)].append(head)
+
+    def _join(self, i, j, head):
+        domain = self.streams[i].domain
+        mapping = extend_mapping({}, get_args(domain[j]), head.args)
+        if mapping is None:
+            return
+        # Also records the (domain index, position) of each joined atom to enumerate in cartesian product order
+        mappings = [(mapping, self.depth_from_head[head], ())]
+        for k, positions in self._get_join_order(i, j):
+            params = get_args(domain[k])
+            index = self._get_index(i, k, positions)
+            position_from_head = self.position_from_domain[(i, k)]
+            new_mappings = []
+            for mapping, depth, combo in mappings:
+                for candidate in index.get(tuple(mapping[params[p]] for p in positions), []):
+                    new_mapping = extend_mapping(mapping, params, candidate.args)
+                    if new_mapping is not None:
+                        new_mappings.append((new_mapping, max(depth, self.depth_from_head[candidate]),
+                                             combo + ((k, position_from_head[candidate]),)))
+            mappings = new_mappings
+        mappings.sort(key=lambda entry: sorted(entry[2]))
+        for mapping, depth, _ in mappings:
+            self._add_instance(self.streams[i], tuple(mapping[p] for p in self.streams[i].inputs), depth)
+
+    def add_atom(self, atom, depth=0):
+        # depth is the number of stream applications that produced the atom
         if not is_atom(atom):
             return False
         head = atom.head
         if head in self.atoms:
             return False
         self.atoms.add(head)
+        self.depth_from_head[head] = depth
         # TODO: doing this in a way that will eventually allow constants
 
         for i, stream in enumerate(self.streams):
@@ -69,16 +257,6 @@ class Instantiator(object): # Dynamic Stream Instantiator
                 if any(isinstance(b, Object) and (a != b) for (a, b) in
                        zip(head.args, get_args(domain_atom))):
                     continue
-                self.atoms_from_domain[(i, j)].append(head)
-                values = [self.atoms_from_domain[(i, k)] if j != k else [head]
-                          for k in range(len(stream.domain))]
-                domain = list(map(head_from_fact, stream.domain))
-                #domain = stream.domain
-                for combo in product(*values):
-                    mapping = get_mapping(domain, combo)
-                    if mapping is None:
-                        continue
-                    input_objects = tuple(mapping[p] for p in stream.inputs)
-                    self._add_instance(stream, input_objects)
+                self._add_domain_atom(i, j, head)
+                self._join(i, j, head)
         return True
-
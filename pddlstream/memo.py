@@ -0,0 +1,183 @@
+from __future__ import print_function
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from pddlstream.utils import INF, ensure_dir
+
+MEMO_FILENAME = 'data/memo.db'
+PICKLE_PROTOCOL = 2 # Shared by Python 2 and 3
+
+CREATE_TABLE = """CREATE TABLE IF NOT EXISTS results (
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    inputs TEXT NOT NULL,
+    call INTEGER NOT NULL,
+    outputs BLOB NOT NULL,
+    enumerated INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL,
+    overhead REAL NOT NULL DEFAULT 0,
+    state BLOB,
+    PRIMARY KEY (name, version, inputs, call))"""
+
+ADDED_COLUMNS = [ # Columns missing from memos written by earlier versions
+    ('overhead', 'REAL NOT NULL DEFAULT 0'),
+    ('state', 'BLOB'),
+]
+
+
+def dump_values(values):
+    # Returns None for values that cannot be pickled
+    try:
+        return pickle.dumps(values, protocol=PICKLE_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None
+
+
+def hash_values(values):
+    data = dump_values(values)
+    if data is None:
+        return None
+    return hashlib.sha1(data).hexdigest()
+
+
+class ResultMemo(object):
+    """
+    Persistent SQLite memo of stream and function outputs keyed by
+    (external name, version, hash of the input values, call index)
+    Each entry also stores the overhead of the original call and, when it can be pickled,
+    the state of the generator after the call so that a later miss can resume from it
+    Entries are evicted in least recently used order once max_size bytes or max_entries are exceeded
+    Access times of hits are buffered and only written with the next store or on close
+    """
+    _active = threading.local()
+    def __init__(self, filename=MEMO_FILENAME, version='', max_size=INF, max_entries=INF):
+        self.filename = filename
+        self.version = str(version)
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_entries = 0 # Running totals of the table
+        self.total_size = 0
+        self.accessed = {} # Key -> access time of hits that are not yet written
+        self.connection = None
+    @staticmethod
+    def get_stack():
+        if not hasattr(ResultMemo._active, 'stack'):
+            ResultMemo._active.stack = []
+        return ResultMemo._active.stack
+    def connect(self):
+        if self.connection is None:
+            if os.path.dirname(self.filename):
+                ensure_dir(self.filename)
+            self.connection = sqlite3.connect(self.filename)
+            self.connection.execute(CREATE_TABLE)
+            columns = {row[1] for row in self.connection.execute('PRAGMA table_info(results)')}
+            for column, definition in ADDED_COLUMNS:
+                if column not in columns:
+                    self.connection.execute('ALTER TABLE results ADD COLUMN {} {}'.format(column, definition))
+            self.connection.execute('CREATE INDEX IF NOT EXISTS accessed ON results (accessed)')
+            num_entries, size = self.connection.execute('SELECT COUNT(*), SUM(size) FROM results').fetchone()
+            self.num_entries, self.total_size = num_entries, size or 0
+            self.evict() # The caps may be smaller than those of a previous run
+            self.connection.commit()
+        return self.connection
+    def get_key(self, instance):
+        external = instance.external
+        inputs = hash_values(instance.get_input_values())
+        if inputs is None:
+            return None
+        version = '{}:{}'.format(self.version, '' if external.info.version is None else external.info.version)
+        return external.name, version, inputs, instance.total_calls
+    def lookup(self, key):
+        # Returns (outputs, enumerated, overhead) or None
+        row = self.connect().execute('SELECT outputs, enumerated, overhead FROM results WHERE '
+                                     'name=? AND version=? AND inputs=? AND call=?', key).fetchone()
+        if row is None:
+            self.num_misses += 1
+            return None
+        self.num_hits += 1
+        self.accessed[key] = time.time()
+        return pickle.loads(bytes(row[0])), bool(row[1]), row[2]
+    def lookup_state(self, key):
+        # Returns the generator state stored after the call or None
+        row = self.connect().execute('SELECT state FROM results WHERE '
+                                     'name=? AND version=? AND inputs=? AND call=?', key).fetchone()
+        if (row is None) or (row[0] is None):
+            return None
+        return pickle.loads(bytes(row[0]))
+    def store(self, key, outputs, enumerated, overhead=0, state=None):
+        data = dump_values(outputs)
+        if data is None:
+            return False
+        state_data = None if state is None else dump_values(state)
+        size = len(data) + (0 if state_data is None else len(state_data))
+        if self.max_size < size:
+            return False
+        connection = self.connect()
+        row = connection.execute('SELECT size FROM results WHERE '
+                                 'name=? AND version=? AND inputs=? AND call=?', key).fetchone()
+        if row is None:
+            self.num_entries += 1
+        else:
+            self.total_size -= row[0]
+        connection.execute('INSERT OR REPLACE INTO results (name, version, inputs, call, outputs, enumerated, '
+                           'size, accessed, overhead, state) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           key + (sqlite3.Binary(data), int(enumerated), size, time.time(), overhead,
+                                  None if state_data is None else sqlite3.Binary(state_data)))
+        self.total_size += size
+        self.evict()
+        self.flush()
+        return True
+    def flush(self):
+        # Writes the buffered access times and commits
+        if self.accessed:
+            self.connection.executemany('UPDATE results SET accessed=? WHERE '
+                                        'name=? AND version=? AND inputs=? AND call=?',
+                                        [(accessed,) + key for key, accessed in self.accessed.items()])
+            self.accessed = {}
+        self.connection.commit()
+    def evict(self):
+        while (self.max_entries < self.num_entries) or (self.max_size < self.total_size):
+            if self.accessed:
+                self.flush() # Eviction order depends on the access times
+            num_excess = max(self.num_entries - self.max_entries, 1)
+            rows = self.connection.execute('SELECT rowid, size FROM results ORDER BY accessed LIMIT ?',
+                                           (int(num_excess),)).fetchall()
+            self.connection.executemany('DELETE FROM results WHERE rowid=?', [(rowid,) for rowid, _ in rows])
+            self.num_entries -= len(rows)
+            self.total_size -= sum(size for _, size in rows)
+    def size(self):
+        self.connect()
+        return {'entries': self.num_entries, 'bytes': self.total_size, 'hits': self.num_hits, 'misses': self.num_misses}
+    def clear(self):
+        self.connect().execute('DELETE FROM results')
+        self.num_entries, self.total_size = 0, 0
+        self.accessed = {}
+        self.connection.commit()
+    def close(self):
+        if self.connection is not None:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+    def __enter__(self):
+        self.get_stack().append(self)
+        return self
+    def __exit__(self, type, value, traceback):
+        self.get_stack().remove(self)
+        self.close()
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.filename)
+
+
+def get_result_memo():
+    stack = ResultMemo.get_stack()
+    if stack:
+        return stack[-1]
+    return None
@@ -1,25 +1,108 @@
+import threading
 from collections import Hashable, namedtuple
 
 USE_HASH = True
+HASH_CONTENT = False # Identifies unhashable array values by their contents rather than their id
+CONTENT_RESOLUTION = None # Array values are quantized to this resolution before hashing
+
+
+def get_content_key(value, resolution=None):
+    # Duck-typed to avoid depending on NumPy
+    if not all(hasattr(value, attr) for attr in ['tobytes', 'dtype', 'shape']):
+        return None
+    if resolution is not None:
+        value = (value / resolution).round() + 0.0 # Adding 0.0 turns -0.0 into 0.0
+    return type(value), str(value.dtype), tuple(value.shape), value.tobytes()
+
+
+class ObjectRegistry(object):
+    """
+    Owns the lookup tables of every Object, OptimisticObject and interned fact created within its scope
+    Exiting the scope releases the tables so a long running process does not accumulate objects
+    """
+    _active = threading.local()
+    def __init__(self, release=True, hash_content=None, resolution=None):
+        self.release_on_exit = release
+        self.hash_content = HASH_CONTENT if hash_content is None else hash_content
+        self.resolution = CONTENT_RESOLUTION if resolution is None else resolution
+        self.num_duplicates = 0 # Values collapsed into an existing object by content
+        self.duplicates = [] # Keeps the duplicate values alive so that their ids are not reused
+        self.obj_from_id = {}
+        self.obj_from_key = {}
+        self.obj_from_value = {}
+        self.obj_from_name = {}
+        self.opt_from_inputs = {}
+        self.opt_from_name = {}
+        self.head_from_key = {}
+        self.evaluation_from_key = {}
+        self.evaluation_from_fact = {}
+    @staticmethod
+    def get_stack():
+        if not hasattr(ObjectRegistry._active, 'stack'):
+            ObjectRegistry._active.stack = []
+        return ObjectRegistry._active.stack
+    def size(self):
+        return {
+            'objects': len(self.obj_from_name),
+            'optimistic': len(self.opt_from_name),
+            'heads': len(self.head_from_key),
+            'evaluations': len(self.evaluation_from_key),
+            'duplicates': self.num_duplicates,
+        }
+    def get_content_key(self, value):
+        if not self.hash_content:
+            return None
+        return get_content_key(value, self.resolution)
+    def release(self):
+        self.num_duplicates = 0
+        self.duplicates = []
+        for table in [self.obj_from_id, self.obj_from_key, self.obj_from_value, self.obj_from_name,
+                      self.opt_from_inputs, self.opt_from_name, self.head_from_key,
+                      self.evaluation_from_key, self.evaluation_from_fact]:
+            table.clear()
+    def __len__(self):
+        return len(self.obj_from_name) + len(self.opt_from_name)
+    def __enter__(self):
+        self.get_stack().append(self)
+        return self
+    def __exit__(self, type, value, traceback):
+        self.get_stack().remove(self)
+        if self.release_on_exit:
+            self.release()
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.size())
+
+
+DEFAULT_REGISTRY = ObjectRegistry(release=False) # Used outside of any solve
+
+
+def get_object_registry():
+    stack = ObjectRegistry.get_stack()
+    if stack:
+        return stack[-1]
+    return DEFAULT_REGISTRY
+
+##################################################
 
 class Object(object):
     _prefix = 'o'
-    _obj_from_id = {}
-    _obj_from_value = {}
-    #_obj_from_index = []
-    _obj_from_name = {}
     def __init__(self, value, stream_instance=None, name=None):
         # TODO: unique vs hash
+        registry = get_object_registry()
         self.value = value
-        self.index = len(Object._obj_from_name)
+        self.index = len(registry.obj_from_name)
         if name is None:
             name = '{}{}'.format(self._prefix, self.index)
         self.name = name
         self.stream_instance = stream_instance # TODO: store first created stream instance
-        Object._obj_from_id[id(self.value)] = self
-        Object._obj_from_name[self.name] = self
+        registry.obj_from_id[id(self.value)] = self
+        registry.obj_from_name[self.name] = self
         if isinstance(value, Hashable):
-            Object._obj_from_value[self.value] = self
+            registry.obj_from_value[self.value] = self
+        else:
+            key = registry.get_content_key(value)
+            if key is not None:
+                registry.obj_from_key.setdefault(key, self)
     @property
     def pddl(self):
         #return self._template.format(self.n)
@@ -27,29 +110,44 @@ class Object(object):
         return self.name
     @staticmethod
     def from_id(value):
-        if id(value) not in Object._obj_from_id:
-            return Object(value)
-        return Object._obj_from_id[id(value)]
+        registry = get_object_registry()
+        if id(value) in registry.obj_from_id:
+            return registry.obj_from_id[id(value)]
+        key = registry.get_content_key(value)
+        if key in registry.obj_from_key:
+            # Each duplicate is counted once and then found by id
+            obj = registry.obj_from_key[key]
+            registry.obj_from_id[id(value)] = obj
+            registry.duplicates.append(value)
+            registry.num_duplicates += 1
+            return obj
+        return Object(value)
     @staticmethod
     def has_value(value):
+        registry = get_object_registry()
         if USE_HASH and not isinstance(value, Hashable):
-            return id(value) in Object._obj_from_id
-        return value in Object._obj_from_value
+            return (id(value) in registry.obj_from_id) or \
+                   (registry.get_content_key(value) in registry.obj_from_key)
+        return value in registry.obj_from_value
     @staticmethod
     def from_value(value):
         if USE_HASH and not isinstance(value, Hashable):
             return Object.from_id(value)
-        if value not in Object._obj_from_value:
+        obj_from_value = get_object_registry().obj_from_value
+        if value not in obj_from_value:
             return Object(value)
-        return Object._obj_from_value[value]
+        return obj_from_value[value]
     #@staticmethod
     #def from_index(index):
     #    return Object._obj_from_index[index]
     @staticmethod
+    def has_name(name):
+        return name in get_object_registry().obj_from_name
+    @staticmethod
     def from_name(name):
         #index = int(name.split(Object._prefix)[1]) # TODO: match regex or strip prefix
         #return Object.from_index(index)
-        return Object._obj_from_name[name]
+        return get_object_registry().obj_from_name[name]
     def __lt__(self, other): # For heapq on python3
         return self.index < other.index
     def __repr__(self):
@@ -76,33 +174,36 @@ class Object(object):
 
 class OptimisticObject(object):
     _prefix = '#' # $ % #
-    _obj_from_inputs = {}
-    _obj_from_name= {}
     def __init__(self, value, param):
         # TODO: store first created instance
+        registry = get_object_registry()
         self.value = value
         self.param = param
         #stream_instance, output_index = value
         #self.stream_instance = stream_instance
         #self.output_index = output_index
-        self.index = len(OptimisticObject._obj_from_inputs)
+        self.index = len(registry.opt_from_inputs)
         #self.name = '{}{}{}'.format(self._prefix, self.parameter[1:], self.index)
         self.name = '{}{}'.format(self._prefix, self.index)
         key = (value, param)
-        OptimisticObject._obj_from_inputs[key] = self
-        OptimisticObject._obj_from_name[self.name] = self
+        registry.opt_from_inputs[key] = self
+        registry.opt_from_name[self.name] = self
     #@property
     #def parameter(self):
     #    return self.stream_instance.stream.outputs[self.output_index]
     @staticmethod
     def from_opt(value, param):
         key = (value, param)
-        if key not in OptimisticObject._obj_from_inputs:
+        opt_from_inputs = get_object_registry().opt_from_inputs
+        if key not in opt_from_inputs:
             return OptimisticObject(value, param)
-        return OptimisticObject._obj_from_inputs[key]
+        return opt_from_inputs[key]
+    @staticmethod
+    def has_name(name):
+        return name in get_object_registry().opt_from_name
     @staticmethod
     def from_name(name):
-        return OptimisticObject._obj_from_name[name]
+        return get_object_registry().opt_from_name[name]
     @property
     def pddl(self):
         return self.name
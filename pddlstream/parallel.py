@@ -0,0 +1,132 @@
+from __future__ import print_function
+
+import multiprocessing
+import time
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from pddlstream.function import Function
+from pddlstream.stream import BoundedGenerator
+from pddlstream.utils import elapsed_time
+
+THREADS = 'threads' # Samplers that release the GIL (NumPy, I/O, extension modules)
+PROCESSES = 'processes' # Only functions and single-shot streams (from_fn, from_test, from_list_fn)
+ASYNCIO = 'asyncio' # Only async generator and coroutine externals (Python 3)
+POLL_TIME = 1e-3 # Seconds between checks for any completed call when not deterministic
+
+_external_from_name = {} # Inherited by forked workers
+
+def _evaluate_thread(instance):
+    start_time = time.time()
+    outputs = instance._next_outputs()
+    return outputs, elapsed_time(start_time)
+
+def _evaluate_process(name, input_values):
+    # Generator state cannot be returned from a worker, so only single-shot calls are evaluated
+    external = _external_from_name[name]
+    start_time = time.time()
+    if isinstance(external, Function):
+        return external.fn(*input_values), elapsed_time(start_time)
+    generator = external.gen_fn(*input_values)
+    if not isinstance(generator, BoundedGenerator) or (1 < generator.max_calls):
+        return None
+    try:
+        outputs = next(generator)
+    except StopIteration:
+        outputs = []
+    return outputs, elapsed_time(start_time)
+
+def get_pool(parallel, max_workers, externals):
+    if parallel == THREADS:
+        return ThreadPool(max_workers)
+    if parallel == ASYNCIO:
+        from pddlstream.asynchronous import AsyncPool
+        return AsyncPool()
+    if parallel == PROCESSES:
+        _external_from_name.clear()
+        _external_from_name.update((external.name, external) for external in externals)
+        get_context = getattr(multiprocessing, 'get_context', None) # Python 3
+        context = multiprocessing if get_context is None else get_context('fork')
+        return context.Pool(max_workers)
+    raise ValueError('Unknown parallel mode: {}'.format(parallel))
+
+##################################################
+
+class StreamExecutor(object):
+    """
+    Evaluates stream and function instances on a pool of worker threads or processes
+    Output values are converted into results (and objects) in the calling thread
+    """
+    def __init__(self, externals, parallel=None, max_workers=None, deterministic=True):
+        """
+        :param parallel: None (serial), THREADS, PROCESSES or ASYNCIO
+        :param max_workers: the number of workers (defaults to the number of cpus)
+        :param deterministic: if True, results are merged in submission order rather than completion order
+        """
+        self.externals = externals
+        self.parallel = parallel
+        self.max_workers = multiprocessing.cpu_count() if max_workers is None else max_workers
+        self.max_pending = 2*self.max_workers
+        self.deterministic = deterministic
+        self.serial_names = set() # Externals with generators that cannot be evaluated in a process
+        self.pool = None
+    def _submit(self, instance):
+        if self.pool is None:
+            return None
+        if self.parallel == ASYNCIO:
+            return self.pool.submit(instance) if instance.external.is_async else None
+        if instance.external.is_async:
+            return None # Async generators are bound to the event loop of the main thread
+        if self.parallel == PROCESSES:
+            if (instance.external.name in self.serial_names) or (getattr(instance, '_generator', None) is not None):
+                return None
+            return self.pool.apply_async(_evaluate_process, (instance.external.name, instance.get_input_values()))
+        return self.pool.apply_async(_evaluate_thread, (instance,))
+    def _pop(self, pending):
+        if self.deterministic:
+            return pending.popleft()
+        while True:
+            for i, (_, handle) in enumerate(pending):
+                if (handle is None) or handle.ready():
+                    entry = pending[i]
+                    del pending[i]
+                    return entry
+            pending[0][1].wait(POLL_TIME)
+    def _finish(self, instance, handle, verbose):
+        if handle is None:
+            return instance.next_results(verbose=verbose)
+        output = handle.get()
+        if output is None:
+            self.serial_names.add(instance.external.name)
+            return instance.next_results(verbose=verbose)
+        outputs, overhead = output
+        if self.parallel == PROCESSES:
+            instance._exhausted = True
+        return instance._process_outputs(outputs, time.time() - overhead, verbose=verbose)
+    def imap(self, instances, verbose=False, is_terminated=lambda: False):
+        """
+        Yields (instance, results) pairs for the instances in an iterator
+        Instances are no longer drawn from the iterator once is_terminated() is True
+        """
+        instances = iter(instances)
+        pending = deque()
+        while True:
+            while (len(pending) < self.max_pending) and not is_terminated():
+                instance = next(instances, None)
+                if instance is None:
+                    break
+                assert not instance.enumerated
+                pending.append((instance, self._submit(instance)))
+            if not pending:
+                break
+            instance, handle = self._pop(pending)
+            yield instance, self._finish(instance, handle, verbose)
+    def __enter__(self):
+        if self.parallel is not None:
+            self.pool = get_pool(self.parallel, self.max_workers, self.externals)
+        return self
+    def __exit__(self, type, value, traceback):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
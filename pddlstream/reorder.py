@@ -187,6 +187,8 @@ def replace_derived(task, negative_init, action_instances):
     task.actions = []
     function_assignments = {f.fluent: f.expression for f in task.init
                             if isinstance(f, pddl.f_expression.FunctionAssignment)}
+    # task.init remains a set rather than a BitState: the translator re-reads all of it to compute the model
+    # after every action, and it contains the negated atoms of negative_init, which BitState masks do not represent
     task.init = (set(task.init) | {a.negate() for a in negative_init}) - set(function_assignments)
     fluent_facts = MockSet()
     for instance in action_instances:
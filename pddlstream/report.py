@@ -0,0 +1,160 @@
+from __future__ import print_function
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from pddlstream.utils import INF
+
+REPORT_FILENAME = None # Appends one JSON line per planner call when set
+
+
+class PlannerCall(object):
+    """
+    Timing record of a single call to the planner
+    """
+    def __init__(self, planner):
+        self.planner = planner
+        self.start_time = time.time()
+        self.runtime = None
+        self.phases = OrderedDict()
+        self.sizes = {}
+        self.cached = [] # Names of the caches that were hit
+        self.outcome = None
+        self.cost = INF
+    def add_phase(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0) + duration
+    def finish(self, outcome, cost=INF):
+        self.runtime = time.time() - self.start_time
+        self.outcome = outcome
+        self.cost = cost
+    def to_dict(self):
+        return OrderedDict([
+            ('planner', str(self.planner)),
+            ('runtime', self.runtime),
+            ('phases', self.phases),
+            ('sizes', self.sizes),
+            ('cached', self.cached),
+            ('outcome', self.outcome),
+            ('cost', None if self.cost == INF else self.cost),
+        ])
+    def __repr__(self):
+        return '{}({}, {})'.format(self.__class__.__name__, self.planner, self.outcome)
+
+
+class SolveReport(object):
+    """
+    Collects a PlannerCall for every planner call within a solve
+    Phases that occur outside of a planner call (e.g. parsing) are recorded on the report itself
+    """
+    _active = threading.local()
+    last = None
+    def __init__(self, filename=None):
+        self.filename = REPORT_FILENAME if filename is None else filename
+        self.start_time = None
+        self.runtime = None
+        self.phases = OrderedDict()
+        self.calls = []
+        self.current = None
+    @staticmethod
+    def get_stack():
+        if not hasattr(SolveReport._active, 'stack'):
+            SolveReport._active.stack = []
+        return SolveReport._active.stack
+    def add_phase(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0) + duration
+    def start_call(self, planner):
+        self.current = PlannerCall(planner)
+        self.calls.append(self.current)
+        return self.current
+    def finish_call(self, outcome, cost=INF):
+        call = self.current
+        self.current = None
+        if call is None:
+            return None
+        call.finish(outcome, cost)
+        if self.filename is not None:
+            with open(self.filename, 'a') as f:
+                f.write(json.dumps(call.to_dict()) + '\n')
+        return call
+    def total_phases(self):
+        totals = OrderedDict(self.phases)
+        for call in self.calls:
+            for name, duration in call.phases.items():
+                totals[name] = totals.get(name, 0) + duration
+        return totals
+    def elapsed_time(self):
+        if self.runtime is not None:
+            return self.runtime
+        return time.time() - self.start_time
+    def dump(self):
+        print('\nPlanner calls: {} | Runtime: {:.3f}'.format(len(self.calls), self.elapsed_time()))
+        for name, duration in self.total_phases().items():
+            print('{}: {:.3f}'.format(name, duration))
+    def __enter__(self):
+        self.start_time = time.time()
+        self.get_stack().append(self)
+        return self
+    def __exit__(self, type, value, traceback):
+        self.runtime = time.time() - self.start_time
+        self.get_stack().remove(self)
+        SolveReport.last = self
+
+
+def get_report():
+    stack = SolveReport.get_stack()
+    if stack:
+        return stack[-1]
+    return None
+
+
+class Phase(object):
+    """
+    Adds the duration of its body to the active planner call (or report)
+    """
+    def __init__(self, name):
+        self.name = name
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+    def __exit__(self, type, value, traceback):
+        report = get_report()
+        if report is None:
+            return
+        target = report if report.current is None else report.current
+        target.add_phase(self.name, time.time() - self.start_time)
+
+
+def start_call(planner):
+    report = get_report()
+    if report is None:
+        return None
+    return report.start_call(planner)
+
+
+def finish_call(outcome, cost=INF):
+    report = get_report()
+    if report is None:
+        return None
+    return report.finish_call(outcome, cost)
+
+
+def get_sas_sizes(sas_task):
+    return {
+        'variables': len(sas_task.variables.ranges),
+        'operators': len(sas_task.operators),
+        'axioms': len(sas_task.axioms),
+    }
+
+
+def record_sizes(sizes):
+    report = get_report()
+    if (report is not None) and (report.current is not None):
+        report.current.sizes.update(sizes)
+
+
+def record_cache_hit(name):
+    report = get_report()
+    if (report is not None) and (report.current is not None):
+        report.current.cached.append(name)
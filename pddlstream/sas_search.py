@@ -0,0 +1,244 @@
+from __future__ import print_function
+
+import re
+import time
+from heapq import heappush, heappop
+
+from pddlstream.utils import INF
+
+MAX_PYTHON_OPERATORS = 100 # Larger tasks are sent to FastDownward
+OPTIMAL_PLANNERS = ['max-astar', 'lmcut-astar'] # Both use hmax in Python
+
+
+class UnaryOperator(object):
+    def __init__(self, preconditions, effect, cost, index):
+        self.preconditions = preconditions
+        self.effect = effect
+        self.cost = cost
+        self.index = index
+
+
+class Operator(object):
+    def __init__(self, name, preconditions, effects, cost):
+        self.name = name
+        self.preconditions = preconditions
+        self.effects = effects # (var, post, conditions)
+        self.cost = cost
+    def is_applicable(self, state):
+        return all(state[var] == val for var, val in self.preconditions)
+    def apply(self, state):
+        new_state = list(state)
+        for var, post, conditions in self.effects:
+            if all(state[v] == d for v, d in conditions):
+                new_state[var] = post
+        return new_state
+
+
+class SASProblem(object):
+    """
+    Compiled form of a translator SASTask for searching within Python
+    """
+    def __init__(self, sas_task):
+        self.ranges = sas_task.variables.ranges
+        self.axiom_layers = sas_task.variables.axiom_layers
+        self.offsets = []
+        num_facts = 0
+        for size in self.ranges:
+            self.offsets.append(num_facts)
+            num_facts += size
+        self.num_facts = num_facts
+        self.goal = sas_task.goal.pairs
+        self.default = list(sas_task.init.values)
+        self.derived = [var for var, layer in enumerate(self.axiom_layers) if layer != -1]
+        self.operators = []
+        for op in sas_task.operators:
+            preconditions = list(op.prevail) + [(var, pre) for var, pre, _, _ in op.pre_post if pre != -1]
+            effects = [(var, post, cond) for var, _, post, cond in op.pre_post]
+            cost = op.cost if sas_task.metric else 1
+            self.operators.append(Operator(op.name, preconditions, effects, cost))
+        self.axioms_from_layer = {}
+        for axiom in sas_task.axioms:
+            layer = self.axiom_layers[axiom.effect[0]]
+            self.axioms_from_layer.setdefault(layer, []).append(axiom)
+        self.init = self.evaluate_axioms(self.default)
+        self._compile_unary(sas_task)
+
+    def fact(self, var, val):
+        return self.offsets[var] + val
+
+    def _compile_unary(self, sas_task):
+        self.unary_operators = []
+        for index, op in enumerate(self.operators):
+            for var, post, conditions in op.effects:
+                preconditions = frozenset(self.fact(v, d) for v, d in op.preconditions + list(conditions))
+                self.unary_operators.append(UnaryOperator(preconditions, self.fact(var, post), op.cost, index))
+        for axiom in sas_task.axioms:
+            preconditions = frozenset(self.fact(v, d) for v, d in axiom.condition)
+            self.unary_operators.append(UnaryOperator(preconditions, self.fact(*axiom.effect), 0, None))
+        self.unary_from_fact = [[] for _ in range(self.num_facts)]
+        for unary in self.unary_operators:
+            for fact in unary.preconditions:
+                self.unary_from_fact[fact].append(unary)
+        self.goal_facts = frozenset(self.fact(var, val) for var, val in self.goal)
+
+    def evaluate_axioms(self, state):
+        # Derived variables are reset to their default value and then layer-by-layer saturated
+        state = list(state)
+        for var, layer in enumerate(self.axiom_layers):
+            if layer != -1:
+                state[var] = self.default[var]
+        for layer in sorted(self.axioms_from_layer):
+            changed = True
+            while changed:
+                changed = False
+                for axiom in self.axioms_from_layer[layer]:
+                    var, val = axiom.effect
+                    if (state[var] != val) and all(state[v] == d for v, d in axiom.condition):
+                        state[var] = val
+                        changed = True
+        return state
+
+    def is_goal(self, state):
+        return all(state[var] == val for var, val in self.goal)
+
+    def successors(self, state):
+        for op in self.operators:
+            if op.is_applicable(state):
+                yield op, tuple(self.evaluate_axioms(op.apply(state)))
+
+##################################################
+
+def relaxed_exploration(problem, state, combine, plus_one=False):
+    # Generalized Dijkstra over facts where combine is max (hmax) or sum (hadd)
+    cost = [INF] * problem.num_facts
+    supporter = [None] * problem.num_facts
+    remaining = {unary: len(unary.preconditions) for unary in problem.unary_operators}
+    accumulated = {unary: 0 for unary in problem.unary_operators}
+    queue = []
+    def push(fact, value, unary):
+        if value < cost[fact]:
+            cost[fact] = value
+            supporter[fact] = unary
+            heappush(queue, (value, fact))
+    for var, val in enumerate(state):
+        push(problem.fact(var, val), 0, None)
+    for var in problem.derived:
+        # Without negative axioms, default values of derived variables are free (as in FastDownward)
+        push(problem.fact(var, problem.default[var]), 0, None)
+    for unary in problem.unary_operators:
+        if not unary.preconditions:
+            push(unary.effect, unary.cost + plus_one, unary)
+    unreached = set(problem.goal_facts)
+    while queue and unreached:
+        value, fact = heappop(queue)
+        if cost[fact] < value:
+            continue
+        unreached.discard(fact)
+        for unary in problem.unary_from_fact[fact]:
+            accumulated[unary] = combine(accumulated[unary], value)
+            remaining[unary] -= 1
+            if not remaining[unary]:
+                push(unary.effect, accumulated[unary] + unary.cost + (plus_one and unary.index is not None), unary)
+    return cost, supporter
+
+
+def h_max(problem, state):
+    cost, _ = relaxed_exploration(problem, state, max)
+    return max([cost[fact] for fact in problem.goal_facts] + [0])
+
+
+def h_ff(problem, state):
+    cost, supporter = relaxed_exploration(problem, state, lambda a, b: a + b, plus_one=True)
+    if any(cost[fact] == INF for fact in problem.goal_facts):
+        return INF
+    relaxed_plan = set()
+    marked = set()
+    stack = list(problem.goal_facts)
+    while stack:
+        fact = stack.pop()
+        if fact in marked:
+            continue
+        marked.add(fact)
+        unary = supporter[fact]
+        if unary is None:
+            continue
+        if unary.index is not None:
+            relaxed_plan.add(unary.index)
+        stack.extend(unary.preconditions)
+    return sum(problem.operators[index].cost + 1 for index in relaxed_plan)
+
+##################################################
+
+def best_first_search(problem, priority_fn, heuristic_fn, max_time=INF, max_cost=INF):
+    # Returns a list of operators or None
+    start_time = time.time()
+    init = tuple(problem.init)
+    h = heuristic_fn(problem, init)
+    if h == INF:
+        return None, INF
+    best_g = {init: 0}
+    parent = {init: None}
+    queue = [(priority_fn(0, h), 0, init)]
+    while queue and ((time.time() - start_time) < max_time):
+        _, g, state = heappop(queue)
+        if best_g[state] < g:
+            continue
+        if problem.is_goal(state):
+            plan = []
+            while parent[state] is not None:
+                op, state = parent[state]
+                plan.append(op)
+            return plan[::-1], g
+        for op, new_state in problem.successors(state):
+            new_g = g + op.cost
+            if (max_cost <= new_g) or (best_g.get(new_state, INF) <= new_g):
+                continue
+            h = heuristic_fn(problem, new_state)
+            if h == INF:
+                continue
+            best_g[new_state] = new_g
+            parent[new_state] = (op, state)
+            heappush(queue, (priority_fn(new_g, h), new_g, new_state))
+    return None, INF
+
+
+def astar(problem, heuristic_fn=h_max, weight=1, **kwargs):
+    return best_first_search(problem, lambda g, h: (g + weight*h, h), heuristic_fn, **kwargs)
+
+
+def greedy(problem, heuristic_fn=h_ff, **kwargs):
+    return best_first_search(problem, lambda g, h: (h, g), heuristic_fn, **kwargs)
+
+##################################################
+
+def use_python_search(sas_task):
+    return (sas_task is not None) and (len(sas_task.operators) <= MAX_PYTHON_OPERATORS)
+
+
+def get_python_search(planner):
+    # Maps a FastDownward configuration to the closest search in Python (h_ff replaces other inadmissible heuristics)
+    if planner == 'dijkstra':
+        return lambda problem, **kwargs: astar(problem, lambda *args: 0, **kwargs)
+    if planner in OPTIMAL_PLANNERS:
+        return lambda problem, **kwargs: astar(problem, h_max, **kwargs)
+    if planner.endswith('-astar'):
+        return lambda problem, **kwargs: astar(problem, h_ff, **kwargs)
+    match = re.match(r'.*-wastar(\d+)$', planner)
+    if match is not None:
+        weight = int(match.group(1))
+        return lambda problem, **kwargs: astar(problem, h_ff, weight=weight, **kwargs)
+    return lambda problem, **kwargs: greedy(problem, h_ff, **kwargs)
+
+
+def python_search(sas_task, planner='max-astar', max_time=INF, max_cost=INF, debug=False):
+    # Returns the plan in the same format as the FastDownward plan file
+    start_time = time.time()
+    problem = SASProblem(sas_task)
+    plan, cost = get_python_search(planner)(problem, max_time=max_time, max_cost=max_cost)
+    if debug:
+        print('\nPython search: {} | Operators: {} | Cost: {} | Runtime: {:.3f}'.format(
+            planner, len(problem.operators), cost, time.time() - start_time))
+    if plan is None:
+        return None
+    lines = [op.name for op in plan] + ['; cost = {} (general cost)'.format(cost)]
+    return '\n'.join(lines) + '\n'
@@ -1,3 +1,4 @@
+import time
 from collections import defaultdict, deque, namedtuple
 from heapq import heappush, heappop
 
@@ -8,7 +9,8 @@ from pddlstream.function import PredicateResult
 from pddlstream.scheduling.simultaneous import evaluations_from_stream_plan, extract_function_results, \
     get_results_from_head
 from pddlstream.scheduling.simultaneous import get_stream_actions
-from pddlstream.utils import Verbose, MockSet, find_unique, HeapElement
+from pddlstream.state import AtomIndex, BitState
+from pddlstream.utils import Verbose, MockSet, find_unique, HeapElement, INF, elapsed_time
 
 
 # TODO: reuse the ground problem when solving for sequential subgoals
@@ -28,16 +30,21 @@ def axiom_preimage(axiom, preimage):
     preimage.update(axiom.condition)
 
 def plan_preimage(plan, goal):
+    # Equivalent to applying action_preimage and axiom_preimage but on a bitset of literals
     import pddl
-    preimage = set(goal)
+    index = AtomIndex()
+    preimage = index.get_mask(goal)
     for action in reversed(plan):
         if isinstance(action, pddl.PropositionalAction):
-            action_preimage(action, preimage)
+            assert all(not conditions for conditions, _ in action.add_effects + action.del_effects)
+            preimage &= ~index.get_mask(effect for _, effect in action.add_effects + action.del_effects)
+            preimage |= index.get_mask(action.precondition)
         elif isinstance(action, pddl.PropositionalAxiom):
-            axiom_preimage(action, preimage)
+            preimage &= ~index.get_mask([action.effect])
+            preimage |= index.get_mask(action.condition)
         else:
             raise ValueError(action)
-    return preimage
+    return set(index.get_atoms(preimage))
 
 ##################################################
 
@@ -217,7 +224,7 @@ def get_goal_instance(goal):
     return pddl.PropositionalAction(name, precondition, [], None)
 
 def recover_stream_plan(evaluations, goal_expression, domain, stream_results, action_plan, negative,
-                        unit_costs, optimize=True):
+                        unit_costs, optimize=True, max_time=INF):
     import pddl_to_prolog
     import build_model
     import pddl
@@ -259,8 +266,9 @@ def recover_stream_plan(evaluations, goal_expression, domain, stream_results, ac
     axioms_from_name = get_derived_predicates(opt_task.axioms)
     negative_from_name = {n.name: n for n in negative}
     opt_task.actions = []
-    opt_state = set(opt_task.init)
-    real_state = set(real_task.init)
+    atom_index = AtomIndex(opt_task.init)
+    opt_state = BitState(atom_index, opt_task.init)
+    real_state = BitState(atom_index, real_task.init)
     preimage_plan = []
     function_plan = set()
     for layer in action_instances:
@@ -279,7 +287,7 @@ def recover_stream_plan(evaluations, goal_expression, domain, stream_results, ac
                 model = build_model.compute_model(pddl_to_prolog.translate(opt_task))  # Changes based on init
             opt_task.axioms = original_axioms
 
-            opt_facts = instantiate.get_fluent_facts(opt_task, model) | (opt_state - real_state)
+            opt_facts = instantiate.get_fluent_facts(opt_task, model) | set(opt_state - real_state)
             mock_fluent = MockSet(lambda item: (item.predicate in negative_from_name) or
                                                (item in opt_facts))
             instantiated_axioms = instantiate_necessary_axioms(model, real_state, mock_fluent, axiom_from_action)
@@ -348,7 +356,7 @@ def recover_stream_plan(evaluations, goal_expression, domain, stream_results, ac
     reschedule_problem = get_problem(evaluations, And(*preimage_facts), domain, unit_costs=True)
     reschedule_task = task_from_domain_problem(domain, reschedule_problem)
     reschedule_task.actions, stream_result_from_name = get_stream_actions(stream_results)
-    new_plan, _ = solve_from_task(reschedule_task, planner='max-astar', debug=False)
+    new_plan, _ = solve_from_task(reschedule_task, planner='max-astar', max_time=max_time, debug=False)
     # TODO: investigate admissible heuristics
     if new_plan is None:
         return stream_plan + list(function_plan)
@@ -360,6 +368,7 @@ def recover_stream_plan(evaluations, goal_expression, domain, stream_results, ac
 
 def relaxed_stream_plan(evaluations, goal_expression, domain, stream_results, negative, unit_costs, **kwargs):
     # TODO: alternatively could translate with stream actions on real opt_state and just discard them
+    start_time = time.time()
     opt_evaluations = evaluations_from_stream_plan(evaluations, stream_results)
     problem = get_problem(opt_evaluations, goal_expression, domain, unit_costs)
     task = task_from_domain_problem(domain, problem)
@@ -368,8 +377,9 @@ def relaxed_stream_plan(evaluations, goal_expression, domain, stream_results, ne
         return None, action_cost
     # TODO: just use solve finite?
 
+    max_time = kwargs.get('max_time', INF) - elapsed_time(start_time)
     stream_plan = recover_stream_plan(evaluations, goal_expression, domain, stream_results, action_plan,
-                                      negative, unit_costs)
+                                      negative, unit_costs, max_time=max_time)
     action_plan = obj_from_pddl_plan(action_plan)
     combined_plan = stream_plan + action_plan
 
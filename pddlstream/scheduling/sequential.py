@@ -1,8 +1,10 @@
+import time
+
 from pddlstream.conversion import obj_from_pddl, obj_from_pddl_plan
 from pddlstream.downward import task_from_domain_problem, get_problem, solve_from_task, get_init, TOTAL_COST
 from pddlstream.scheduling.simultaneous import get_stream_actions, evaluations_from_stream_plan, \
     extract_function_results, get_results_from_head
-from pddlstream.utils import find_unique, INF, MockSet
+from pddlstream.utils import find_unique, INF, MockSet, elapsed_time
 
 
 # TODO: interpolate between all the scheduling options
@@ -10,6 +12,7 @@ from pddlstream.utils import find_unique, INF, MockSet
 def sequential_stream_plan(evaluations, goal_expression, domain, stream_results, negated, unit_costs=True, **kwargs):
     if negated:
         raise NotImplementedError()
+    start_time = time.time()
     # TODO: compute preimage and make that the goal instead
     opt_evaluations = evaluations_from_stream_plan(evaluations, stream_results)
     opt_task = task_from_domain_problem(domain, get_problem(opt_evaluations, goal_expression, domain, unit_costs))
@@ -53,8 +56,9 @@ def sequential_stream_plan(evaluations, goal_expression, domain, stream_results,
         if not unit_costs:
             function_plan.update(extract_function_results(results_from_head, action, args))
 
-    planner = kwargs.get('planner', 'ff-astar')
-    combined_plan, _ = solve_from_task(task, planner=planner, **kwargs)
+    kwargs['planner'] = kwargs.get('planner', 'ff-astar')
+    kwargs['max_time'] = kwargs.get('max_time', INF) - elapsed_time(start_time)
+    combined_plan, _ = solve_from_task(task, **kwargs)
     if combined_plan is None:
         return None, obj_from_pddl_plan(action_plan), INF
     stream_plan = []
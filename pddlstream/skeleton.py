@@ -1,6 +1,6 @@
 import time
-from collections import defaultdict, namedtuple
-from heapq import heappush, heappop
+from collections import defaultdict, namedtuple, OrderedDict
+from heapq import heappush, heappop, nsmallest
 from itertools import product
 
 from pddlstream.algorithm import add_certified
@@ -35,6 +35,60 @@ def optimistic_process_streams(evaluations, streams, double_bindings=None):
             stream_results.append(stream_result) # TODO: don't readd if all repeated facts?
     return stream_results
 
+class OptimisticInstantiator(object):
+    """
+    Optimistic stream results over the real evaluations that persist across focused iterations
+    Only newly certified evaluations are instantiated, and optimistic results are only
+    recomputed when their instance's opt_index changes
+    """
+    def __init__(self, evaluations, streams):
+        self.evaluations = evaluations
+        self.instantiator = Instantiator([], streams)
+        self.results_from_instance = OrderedDict() # Processing order
+        self.disabled_instances = []
+    def _process_instance(self, instance):
+        if instance.enumerated:
+            return
+        if instance.disabled:
+            self.disabled_instances.append(instance)
+            return
+        results = instance.next_optimistic()
+        self.results_from_instance[instance] = (instance.opt_index, results)
+        for result in results:
+            for fact in result.get_certified():
+                self.instantiator.add_atom(evaluation_from_fact(fact))
+    def _update(self):
+        self.instantiator.sync(self.evaluations)
+        disabled_instances, self.disabled_instances = self.disabled_instances, []
+        for instance in disabled_instances:
+            self.instantiator.stream_queue.append(instance)
+        for instance, (opt_index, _) in list(self.results_from_instance.items()):
+            if instance.opt_index != opt_index:
+                self._process_instance(instance)
+        while self.instantiator.stream_queue:
+            self._process_instance(self.instantiator.stream_queue.popleft())
+    def get_results(self):
+        # Equivalent to optimistic_process_streams(evaluations, streams) for the current instance states
+        self._update()
+        supported = set(self.evaluations)
+        remaining = [(instance, results) for instance, (_, results) in self.results_from_instance.items()
+                     if not (instance.enumerated or instance.disabled)]
+        stream_results = []
+        changed = True
+        while changed:
+            changed = False
+            unsupported = []
+            for instance, results in remaining:
+                if not all(evaluation_from_fact(fact) in supported for fact in instance.get_domain()):
+                    unsupported.append((instance, results))
+                    continue
+                changed = True
+                for result in results:
+                    supported.update(map(evaluation_from_fact, result.get_certified()))
+                    stream_results.append(result)
+            remaining = unsupported
+        return stream_results
+
 ##################################################
 
 # TODO: can either entirely replace arguments on plan or just pass bindings
@@ -42,6 +96,8 @@ def optimistic_process_streams(evaluations, streams, double_bindings=None):
 # TODO: no point not doing all at once if unique
 # TODO: alternatively store just preimage and reachieve
 
+MAX_CONCURRENT_SKELETONS = 8 # Best skeletons whose async instances are called concurrently
+
 SkeletonKey = namedtuple('SkeletonKey', ['attempts', 'length'])
 Skeleton = namedtuple('Skeleton', ['instance', 'num_processed', 'bindings',
                                    'stream_plan', 'action_plan', 'cost'])
@@ -74,7 +130,12 @@ def proccess_stream_plan(key, sampling_problem, queue, evaluations, store):
     results = []
     for i in range(num_processed, len(instance.results_history)):
         results.extend(instance.results_history[i])
-    if not results and not instance.enumerated:
+    if instance.external.is_async:
+        # Async instances that were already called by advance_async_instances are not called again
+        resample = num_processed == len(instance.results_history)
+    else:
+        resample = not results
+    if resample and not instance.enumerated:
         #print(key.attempts, key.length)
         results = instance.next_results(verbose=store.verbose)
     for result in results:
@@ -109,6 +170,22 @@ def proccess_stream_plan(key, sampling_problem, queue, evaluations, store):
 
 ##################################################
 
+def needs_async_call(skeleton, store):
+    instance = skeleton.instance
+    return (instance is not None) and instance.external.is_async and not instance.enumerated and \
+           (skeleton.num_processed == len(instance.results_history)) and (skeleton.cost < store.best_cost)
+
+def advance_async_instances(queue, store):
+    # Awaits the next calls of the async instances of the best skeletons together rather than one at a time
+    # proccess_stream_plan then consumes the new results_history entries without calling again
+    instances = []
+    for _, skeleton in nsmallest(MAX_CONCURRENT_SKELETONS, queue):
+        if needs_async_call(skeleton, store) and (skeleton.instance not in instances):
+            instances.append(skeleton.instance)
+    if 2 <= len(instances):
+        from pddlstream.asynchronous import next_results_concurrently
+        next_results_concurrently(instances, verbose=store.verbose)
+
 def greedily_process_queue(queue, evaluations, store, max_time):
     # TODO: search until new disabled or new evaluation?
     start_time = time.time()
@@ -116,6 +193,8 @@ def greedily_process_queue(queue, evaluations, store, max_time):
         key, skeleton = queue[0]
         if (key.attempts != 0) and (max_time <= elapsed_time(start_time)):
             break
+        if needs_async_call(skeleton, store):
+            advance_async_instances(queue, store)
         heappop(queue)
         proccess_stream_plan(key, skeleton, queue, evaluations, store)
 
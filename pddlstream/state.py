@@ -0,0 +1,143 @@
+from __future__ import print_function
+
+
+def iterate_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class CompiledAction(object):
+    """
+    Preconditions and effects of a propositional action as bitmasks
+    Conditional effects are stored as (positive mask, negative mask, effect mask)
+    """
+    def __init__(self, index, action):
+        self.pre_pos, self.pre_neg = index.get_condition_masks(action.precondition)
+        self.del_effects = self._compile_effects(index, action.del_effects)
+        self.add_effects = self._compile_effects(index, action.add_effects)
+    @staticmethod
+    def _compile_effects(index, effects):
+        unconditional = 0
+        conditional = []
+        for conditions, effect in effects:
+            if conditions:
+                conditional.append(index.get_condition_masks(conditions) + (index.get_mask([effect]),))
+            else:
+                unconditional |= index.get_mask([effect])
+        return [(0, 0, unconditional)] + conditional
+    def is_applicable(self, bits):
+        return holds(bits, self.pre_pos, self.pre_neg)
+    def apply(self, bits):
+        # Deletes are applied before the add effect conditions are evaluated (like apply_action)
+        bits &= ~get_effect_mask(bits, self.del_effects)
+        return bits | get_effect_mask(bits, self.add_effects)
+
+
+def holds(bits, pos, neg):
+    return ((bits & pos) == pos) and not (bits & neg)
+
+
+def get_effect_mask(bits, effects):
+    mask = 0
+    for pos, neg, effect in effects:
+        if holds(bits, pos, neg):
+            mask |= effect
+    return mask
+
+##################################################
+
+class AtomIndex(object):
+    """
+    Assigns consecutive integer ids to atoms so that sets of atoms can be stored as bitsets
+    """
+    def __init__(self, atoms=[]):
+        self.atoms = []
+        self.id_from_atom = {}
+        self.compiled = {}
+        for atom in atoms:
+            self.get_id(atom)
+    def get_id(self, atom):
+        if atom not in self.id_from_atom:
+            self.id_from_atom[atom] = len(self.atoms)
+            self.atoms.append(atom)
+        return self.id_from_atom[atom]
+    def get_mask(self, atoms):
+        mask = 0
+        for atom in atoms:
+            mask |= 1 << self.get_id(atom)
+        return mask
+    def get_condition_masks(self, conditions):
+        pos, neg = 0, 0
+        for literal in conditions:
+            if literal.negated:
+                neg |= 1 << self.get_id(literal.positive())
+            else:
+                pos |= 1 << self.get_id(literal)
+        return pos, neg
+    def get_atoms(self, mask):
+        return [self.atoms[i] for i in iterate_bits(mask)]
+    def compile(self, action):
+        # Actions are assumed to not be modified after they are first applied
+        key = id(action)
+        if key not in self.compiled:
+            self.compiled[key] = (action, CompiledAction(self, action))
+        return self.compiled[key][1]
+    def __len__(self):
+        return len(self.atoms)
+
+
+class BitState(object):
+    """
+    Set of atoms stored as an integer bitset over an AtomIndex
+    """
+    def __init__(self, index, atoms=[], bits=0):
+        self.index = index
+        self.bits = bits | index.get_mask(atoms)
+    def holds(self, conditions):
+        return holds(self.bits, *self.index.get_condition_masks(conditions))
+    def is_applicable(self, action):
+        return self.index.compile(action).is_applicable(self.bits)
+    def apply(self, action):
+        self.bits = self.index.compile(action).apply(self.bits)
+    def __contains__(self, atom):
+        i = self.index.id_from_atom.get(atom, None)
+        return (i is not None) and bool((self.bits >> i) & 1)
+    def add(self, atom):
+        self.bits |= 1 << self.index.get_id(atom)
+    def discard(self, atom):
+        if atom in self:
+            self.bits ^= 1 << self.index.id_from_atom[atom]
+    def remove(self, atom):
+        if atom not in self:
+            raise KeyError(atom)
+        self.discard(atom)
+    def update(self, atoms):
+        self.bits |= self.index.get_mask(atoms)
+    def copy(self):
+        return BitState(self.index, bits=self.bits)
+    def _get_bits(self, other):
+        if isinstance(other, BitState) and (other.index is self.index):
+            return other.bits
+        return self.index.get_mask(other)
+    def __sub__(self, other):
+        return BitState(self.index, bits=self.bits & ~self._get_bits(other))
+    def __or__(self, other):
+        return BitState(self.index, bits=self.bits | self._get_bits(other))
+    __ror__ = __or__
+    def __and__(self, other):
+        return BitState(self.index, bits=self.bits & self._get_bits(other))
+    __rand__ = __and__
+    def __eq__(self, other):
+        if isinstance(other, BitState) and (other.index is self.index):
+            return self.bits == other.bits
+        return set(self) == set(other)
+    def __ne__(self, other):
+        return not self == other
+    def __iter__(self):
+        return iter(self.index.get_atoms(self.bits))
+    def __len__(self):
+        return bin(self.bits).count('1')
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, list(self))
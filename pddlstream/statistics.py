@@ -73,3 +73,83 @@ def write_stream_statistics(stream_name, externals, verbose):
     write_pickle(filename, data)
     if verbose:
         print('Wrote:', filename)
+
+
+##################################################
+
+PLANNER_FILENAME = 'planners.pp'
+MIN_PLANNER_WINS = 5 # Portfolio runs before committing to a single planner
+PORTFOLIO_PERIOD = 10 # Every k-th selection reruns the portfolio so that the committed planner can change
+
+_planner_statistics = None
+_planner_increments = {} # Counts added since the last write, which are merged with the counts on disk
+
+
+def get_planner_filename():
+    return os.path.join(DATA_DIR, PLANNER_FILENAME)
+
+
+def read_planner_statistics():
+    filename = get_planner_filename()
+    return read_pickle(filename) if os.path.exists(filename) else {}
+
+
+def get_planner_statistics():
+    # Maps a domain name to the wins and winning runtime of each planner
+    global _planner_statistics
+    if _planner_statistics is None:
+        _planner_statistics = read_planner_statistics()
+    return _planner_statistics
+
+
+def add_planner_statistics(planner_statistics, domain_name, planner, key, value):
+    planners = planner_statistics.setdefault(domain_name, {})
+    statistics = planners.setdefault(planner, {'wins': 0, 'runtime': 0.})
+    statistics[key] = statistics.get(key, 0) + value
+
+
+def increment_planner_statistics(domain_name, planner, key, value=1):
+    add_planner_statistics(get_planner_statistics(), domain_name, planner, key, value)
+    add_planner_statistics(_planner_increments, domain_name, planner, key, value)
+
+
+def record_planner_win(domain_name, planner, runtime):
+    increment_planner_statistics(domain_name, planner, 'wins')
+    increment_planner_statistics(domain_name, planner, 'runtime', runtime)
+
+
+def select_planner(domain_name, planners):
+    # Returns None to run the full portfolio
+    statistics = get_planner_statistics().get(domain_name, {})
+    candidates = [planner for planner in planners if planner in statistics]
+    if sum(statistics[planner]['wins'] for planner in candidates) < MIN_PLANNER_WINS:
+        return None
+    num_selections = sum(statistics[planner].get('selections', 0) for planner in candidates)
+    planner = max(candidates, key=lambda p: (statistics[p]['wins'],
+                                             -statistics[p]['runtime'] / statistics[p]['wins']))
+    increment_planner_statistics(domain_name, planner, 'selections')
+    if (num_selections + 1) % PORTFOLIO_PERIOD == 0:
+        return None
+    return planner
+
+
+def write_planner_statistics(verbose):
+    # Adds this process's increments to the counts on disk so concurrent solves do not overwrite each other
+    global _planner_statistics
+    if not _planner_increments:
+        return
+    planner_statistics = read_planner_statistics()
+    for domain_name, planners in _planner_increments.items():
+        for planner, statistics in planners.items():
+            for key, value in statistics.items():
+                add_planner_statistics(planner_statistics, domain_name, planner, key, value)
+    filename = get_planner_filename()
+    ensure_dir(filename)
+    temp_filename = '{}.{}'.format(filename, os.getpid())
+    write_pickle(temp_filename, planner_statistics)
+    replace = getattr(os, 'replace', os.rename) # Python 2
+    replace(temp_filename, filename) # Atomic for concurrent solves
+    _planner_statistics = planner_statistics
+    _planner_increments.clear()
+    if verbose:
+        print('Wrote:', filename)
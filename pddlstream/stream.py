@@ -1,12 +1,14 @@
-from collections import Counter, defaultdict, namedtuple, Sequence, Iterator
+from collections import Counter, defaultdict, namedtuple, deque, Sequence, Iterator
 from itertools import count
 
-from pddlstream.conversion import list_from_conjunction, substitute_expression, get_args, is_parameter
-from pddlstream.downward import parse_lisp
-from pddlstream.function import Result, Instance, External, ExternalInfo, parse_function, \
-    parse_predicate, DEBUG
+from pddlstream.conversion import list_from_conjunction, substitute_expression, get_args, is_parameter, \
+    obj_from_value_expression
+from pddlstream.downward import parse_cached_lisp
+from pddlstream.function import Result, Instance, External, ExternalInfo, BatchFn, parse_function, \
+    parse_predicate, is_coroutine_fn, is_async_gen_fn, DEBUG
 from pddlstream.object import Object, OptimisticObject
 from pddlstream.utils import str_from_tuple, INF
+import threading
 import time
 
 class BoundedGenerator(Iterator):
@@ -52,6 +54,15 @@ def from_fn(fn):
 def from_test(test):
     return from_fn(lambda *args: tuple() if test(*args) else None)
 
+
+def from_batch_fn(batch_fn):
+    # batch_fn maps a list of input tuples to a list of output tuples (or None)
+    return BatchFn(batch_fn)
+
+
+def from_batch_test(batch_test):
+    return from_batch_fn(lambda inputs: [tuple() if outcome else None for outcome in batch_test(inputs)])
+
 #def list_gen_from_constant(constant):
 #    return from_fn(lambda *args: constant)
 #
@@ -119,10 +130,17 @@ class DebugValue(object): # TODO: could just do an object
 
 class StreamInfo(ExternalInfo):
     def __init__(self, opt_gen_fn=None, eager=False,
-                 p_success=None, overhead=None):
-        # TODO: could change frequency/priority for the incremental algorithm
-        super(StreamInfo, self).__init__(eager, p_success, overhead)
+                 p_success=None, overhead=None, priority=None, batch_size=None, version=None,
+                 timeout=None, disable_on_timeout=False, prefetch=0):
+        # TODO: could change frequency for the incremental algorithm
+        # With a ResultMemo, the first call of a generator that misses the memo resumes from the generator
+        # state stored after the previous call when the generator can be pickled (for instance, an iterator
+        # object) and otherwise replays (and discards) the calls that were served from the memo
+        super(StreamInfo, self).__init__(eager, p_success, overhead, batch_size, version,
+                                         timeout, disable_on_timeout)
         self.opt_gen_fn = opt_gen_fn
+        self.priority = priority # Instances of streams with smaller priorities are applied first
+        self.prefetch = prefetch # Number of generator calls advanced ahead of demand in the background
         #self.order = 0
 
 ##################################################
@@ -150,6 +168,10 @@ class StreamInstance(Instance):
     def __init__(self, stream, input_objects):
         super(StreamInstance, self).__init__(stream, input_objects)
         self._generator = None
+        self._num_generated = 0 # Calls to the generator (excluding those served from a ResultMemo)
+        self._buffer = deque() # Prefetched (new_values, exhausted) pairs or the exception that was raised
+        self._condition = threading.Condition() # Guards _buffer and _prefetching
+        self._prefetching = False # Whether a background thread currently owns the generator
         self.opt_index = stream.num_opt_fns
     def _check_output_values(self, new_values):
         if not isinstance(new_values, Sequence):
@@ -161,21 +183,80 @@ class StreamInstance(Instance):
             if len(output_values) != len(self.external.outputs):
                 raise ValueError('An output tuple for stream [{}] has length {} instead of {}: {}'.format(
                     self.external.name, len(output_values), len(self.external.outputs), output_values))
-    def _next_outputs(self):
+    def _get_state(self):
+        # A prefetched or async generator runs ahead of the calls that were served
+        if self.external.is_async or self.external.info.prefetch:
+            return None
+        return self._generator
+    def _skip_outputs(self, num_calls, state=None):
+        # Advances the generator past the calls that were served from a ResultMemo
+        if (state is not None) and (self._generator is None):
+            self._generator = state
+            self._num_generated = num_calls
+        while (self._num_generated < num_calls) and not self._exhausted:
+            self._next_outputs()
+    def _generate(self):
+        # Advances the generator without updating the instance and returns (new_values, exhausted)
         if self._generator is None:
             self._generator = self.external.gen_fn(*self.get_input_values())
-        new_values = []
         try:
             new_values = next(self._generator)
         except StopIteration:
-            self.enumerated = True
-        if isinstance(self._generator, BoundedGenerator):
-            self.enumerated = self._generator.enumerated
+            return [], True
+        exhausted = isinstance(self._generator, BoundedGenerator) and self._generator.enumerated
+        return new_values, exhausted
+    def _prefetch_loop(self):
+        # Once started, only this thread advances the generator until the buffer is full or exhausted
+        while True:
+            try:
+                entry = self._generate()
+            except Exception as error:
+                entry = error
+            with self._condition:
+                self._buffer.append(entry)
+                self._condition.notify_all()
+                if isinstance(entry, Exception) or entry[1] or (self.external.info.prefetch <= len(self._buffer)):
+                    self._prefetching = False
+                    return
+    def _start_prefetch(self):
+        # Must be called while holding _condition
+        self._prefetching = True
+        thread = threading.Thread(target=self._prefetch_loop)
+        thread.daemon = True
+        thread.start()
+    def _next_prefetched(self):
+        # Serves calls from a buffer that is refilled in the background up to info.prefetch calls ahead
+        # The main thread never advances the generator itself, so the generator has a single owner at a time
+        with self._condition:
+            if not (self._buffer or self._prefetching):
+                self._start_prefetch()
+            while not self._buffer:
+                self._condition.wait()
+            entry = self._buffer.popleft()
+            if isinstance(entry, Exception):
+                raise entry
+            exhausted = entry[1] or any(isinstance(e, Exception) or e[1] for e in self._buffer)
+            if not (exhausted or self._prefetching):
+                self._start_prefetch()
+        return entry
+    def _next_outputs(self):
+        self._num_generated += 1
+        if self.external.is_async:
+            from pddlstream.asynchronous import run_next_outputs
+            return run_next_outputs(self)
+        if self.external.info.prefetch:
+            new_values, exhausted = self._next_prefetched()
+        else:
+            new_values, exhausted = self._generate()
+        if exhausted:
+            self._exhausted = True
         return new_values
-    def next_results(self, verbose=False):
-        start_time = time.time()
-        assert not self.enumerated
-        new_values = self._next_outputs()
+    def _from_batch_output(self, output_values):
+        return [] if output_values is None else [output_values]
+    def _process_outputs(self, new_values, start_time, verbose=False):
+        # Converts the output values into results in the main process (objects are created here)
+        if self._exhausted:
+            self.enumerated = True
         if verbose:
             print('{}:{}->[{}]'.format(self.external.name, str_from_tuple(self.get_input_values()),
                                        ', '.join(map(str_from_tuple, new_values))))
@@ -186,6 +267,13 @@ class StreamInstance(Instance):
             results.append(self.external._Result(self, output_objects))
         self.update_statistics(start_time, results)
         return results
+    def next_results(self, verbose=False):
+        start_time = time.time()
+        assert not self.enumerated
+        new_values, start_time = self._next_memo_outputs(start_time)
+        if new_values is None:
+            return self._timeout_results(start_time, verbose=verbose)
+        return self._process_outputs(new_values, start_time, verbose=verbose)
     def next_optimistic(self):
         if self.enumerated or self.disabled:
             return []
@@ -227,6 +315,12 @@ class Stream(External):
         if gen_fn == DEBUG:
             #gen_fn = from_fn(lambda *args: tuple(object() for _ in self.outputs))
             gen_fn = from_fn(lambda *args: tuple(DebugValue(name, args, o) for o in self.outputs))
+        if isinstance(gen_fn, BatchFn):
+            self.batch_fn = gen_fn.batch_fn
+            gen_fn = from_fn(gen_fn)
+        # Async generator functions yield output lists and coroutine functions return a single output list
+        self.is_generator = is_async_gen_fn(gen_fn)
+        self.is_async = self.is_generator or is_coroutine_fn(gen_fn)
         self.gen_fn = gen_fn
         self.outputs = tuple(outputs)
         self.certified = tuple(certified)
@@ -249,7 +343,49 @@ class Stream(External):
 
 ##################################################
 
-# TODO: WildStream, FactStream
+# TODO: FactStream
+
+WildOutput = namedtuple('WildOutput', ['values', 'facts']) # Output values and additional facts over values
+
+class WildResult(StreamResult):
+    def __init__(self, instance, output_objects, opt_index=None, facts=[]):
+        super(WildResult, self).__init__(instance, output_objects, opt_index)
+        self.facts = tuple(facts)
+        self.certified = tuple(self.certified) + self.facts
+    def __repr__(self):
+        return '{}:{}->{}+{}'.format(self.instance.external.name,
+                                     str_from_tuple(self.instance.input_objects),
+                                     str_from_tuple(self.output_objects), len(self.facts))
+
+class WildStreamInstance(StreamInstance):
+    def _process_outputs(self, new_values, start_time, verbose=False):
+        # Each output is either an output tuple or a WildOutput that also certifies arbitrary facts
+        if self._exhausted:
+            self.enumerated = True
+        if not isinstance(new_values, Sequence):
+            raise ValueError('An output list for stream [{}] is not a sequence: {}'.format(self.external.name, new_values))
+        wild_outputs = [output if isinstance(output, WildOutput) else WildOutput(output, [])
+                        for output in new_values]
+        if verbose:
+            print('{}:{}->[{}]'.format(self.external.name, str_from_tuple(self.get_input_values()),
+                                       ', '.join('{}+{}'.format(str_from_tuple(values), len(facts))
+                                                 for values, facts in wild_outputs)))
+        self._check_output_values([values for values, _ in wild_outputs])
+        results = []
+        for values, facts in wild_outputs:
+            output_objects = tuple(map(Object.from_value, values))
+            results.append(self.external._Result(self, output_objects,
+                                                 facts=list(map(obj_from_value_expression, facts))))
+        self.update_statistics(start_time, results)
+        return results
+
+class WildStream(Stream):
+    """
+    A stream whose generator can also certify facts that are not declared in :certified
+    The optimistic results only certify the declared facts
+    """
+    _Instance = WildStreamInstance
+    _Result = WildResult
 
 # class WildResult(object):
 #     def __init__(self, stream_instance, output_objects):
@@ -281,10 +417,11 @@ class Stream(External):
 ##################################################
 
 STREAM_ATTRIBUTES = [':stream', ':inputs', ':domain', ':outputs', ':certified']
+WILD_ATTRIBUTES = [':wild'] + STREAM_ATTRIBUTES[1:]
 
 def parse_stream(lisp_list, stream_map, stream_info):
     attributes = [lisp_list[i] for i in range(0, len(lisp_list), 2)]
-    assert (STREAM_ATTRIBUTES == attributes)
+    assert (attributes in (STREAM_ATTRIBUTES, WILD_ATTRIBUTES))
     values = [lisp_list[i] for i in range(1, len(lisp_list), 2)]
     name, inputs, domain, outputs, certified = values
     if stream_map == DEBUG:
@@ -293,8 +430,9 @@ def parse_stream(lisp_list, stream_map, stream_info):
         if name not in stream_map:
             raise ValueError('Undefined stream conditional generator: {}'.format(name))
         gen_fn = stream_map[name]
-    return Stream(name, gen_fn, tuple(inputs), list_from_conjunction(domain),
-                  tuple(outputs), list_from_conjunction(certified), stream_info.get(name, None))
+    stream_type = WildStream if (attributes == WILD_ATTRIBUTES) else Stream
+    return stream_type(name, gen_fn, tuple(inputs), list_from_conjunction(domain),
+                       tuple(outputs), list_from_conjunction(certified), stream_info.get(name, None))
 
 
 def parse_stream_pddl(stream_pddl, stream_map, stream_info):
@@ -306,7 +444,7 @@ def parse_stream_pddl(stream_pddl, stream_map, stream_info):
     if stream_map != DEBUG:
         stream_map = {k.lower(): v for k, v in stream_map.items()}
     stream_info = {k.lower(): v for k, v in stream_info.items()}
-    stream_iter = iter(parse_lisp(stream_pddl))
+    stream_iter = iter(parse_cached_lisp(stream_pddl))
     assert('define' == next(stream_iter))
     pddl_type, stream_name = next(stream_iter)
     assert('stream' == pddl_type)
@@ -316,7 +454,7 @@ def parse_stream_pddl(stream_pddl, stream_map, stream_info):
         if name == ':stream':
             external = parse_stream(lisp_list, stream_map, stream_info)
         elif name == ':wild':
-            raise NotImplementedError(name)
+            external = parse_stream(lisp_list, stream_map, stream_info)
         elif name == ':rule':
             continue
             # TODO: implement rules
@@ -6,6 +6,8 @@ import sys
 import time
 import math
 import pickle
+import threading
+from collections import OrderedDict
 
 INF = float('inf')
 
@@ -183,4 +185,76 @@ class HeapElement(object):
     def __lt__(self, other):
         return self.key < other.key
     def __iter__(self):
-        return iter([self.key, self.value])
\ No newline at end of file
+        return iter([self.key, self.value])
+
+class SupervisedCall(object):
+    """
+    Calls fn in a daemon thread so that the caller can stop waiting for it
+    The thread cannot be killed, so an abandoned call keeps running until fn returns
+    """
+    def __init__(self, fn):
+        self.value = None
+        self.exc_info = None
+        self.event = threading.Event()
+        thread = threading.Thread(target=self._run, args=(fn,))
+        thread.daemon = True
+        thread.start()
+    def _run(self, fn):
+        try:
+            self.value = fn()
+        except BaseException:
+            self.exc_info = sys.exc_info()
+        finally:
+            self.event.set()
+    def done(self):
+        return self.event.is_set()
+    def wait(self, timeout=None):
+        # Returns True if the call has completed
+        self.event.wait(timeout)
+        return self.done()
+    def get(self):
+        self.wait()
+        if self.exc_info is not None:
+            raise self.exc_info[1]
+        return self.value
+
+class LRUCache(object):
+    """
+    Least recently used cache bounded by the total size of its values
+    """
+    def __init__(self, max_size=INF, size_fn=lambda value: 1):
+        self.max_size = max_size
+        self.size_fn = size_fn
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    def __contains__(self, key):
+        return key in self.entries
+    def __len__(self):
+        return len(self.entries)
+    def get(self, key, default=None):
+        if key not in self.entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        value = self.entries.pop(key)
+        self.entries[key] = value
+        return value
+    def add(self, key, value):
+        if key in self.entries:
+            self.size -= self.size_fn(self.entries.pop(key))
+        self.entries[key] = value
+        self.size += self.size_fn(value)
+        while self.entries and (self.max_size < self.size):
+            _, old_value = self.entries.popitem(last=False)
+            self.size -= self.size_fn(old_value)
+            self.evictions += 1
+        return value
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+    def __repr__(self):
+        return '{}(entries={}, size={}, hits={}, misses={}, evictions={})'.format(
+            self.__class__.__name__, len(self), self.size, self.hits, self.misses, self.evictions)
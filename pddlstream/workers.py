@@ -0,0 +1,137 @@
+from __future__ import print_function
+
+import atexit
+import os
+import subprocess
+import threading
+import time
+
+from pddlstream.utils import INF
+
+# Each search runs in its own process: FastDownward reads a single task per process and only reads
+# its search options (which include the plan file and remaining max_time) from argv
+# Processes therefore are neither reused nor spawned ahead of time
+
+MAX_RETRIES = 1
+KILL_GRACE = 1.0 # Seconds given to the search beyond its own max_time
+
+
+class SearchWorker(object):
+    """
+    A search process that is spawned for a single search and reads its task from stdin
+    """
+    def __init__(self, command, cwd=None):
+        self.command = tuple(command)
+        self.cwd = os.getcwd() if cwd is None else cwd
+        self.process = subprocess.Popen(self.command, cwd=self.cwd, universal_newlines=True,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+        self.start_time = None
+        self.output = None
+        self.timed_out = False
+        self.cancelled = False
+        self._thread = None
+    def is_alive(self):
+        return self.process.poll() is None
+    def is_running(self):
+        return (self._thread is not None) and self._thread.is_alive()
+    @property
+    def returncode(self):
+        return self.process.returncode
+    @property
+    def crashed(self):
+        # Negative return codes indicate a termination signal (e.g. segfault)
+        return not (self.timed_out or self.cancelled) and \
+               (self.returncode is not None) and (self.returncode < 0)
+    def _communicate(self, task_input):
+        try:
+            self.output, _ = self.process.communicate(task_input)
+        except (IOError, OSError, ValueError):
+            self.output = ''
+    def submit(self, task_input):
+        assert self._thread is None
+        self.start_time = time.time()
+        self._thread = threading.Thread(target=self._communicate, args=(task_input,))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+    def kill(self):
+        if self.is_alive():
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+    def cancel(self):
+        self.cancelled = True
+        self.kill()
+        self.wait()
+    def wait(self, timeout=INF):
+        if self._thread is None:
+            return None
+        self._thread.join(None if timeout == INF else max(timeout, 0))
+        if self._thread.is_alive():
+            self.timed_out = True
+            self.kill()
+            self._thread.join()
+        return self.output
+    def elapsed_time(self):
+        if self.start_time is None:
+            return 0
+        return time.time() - self.start_time
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.process.pid)
+
+##################################################
+
+class SearchPool(object):
+    """
+    Launches one search process per search and feeds it the task over a pipe
+    Only adds timeouts, retries of crashed searches and killing the running searches on close
+    """
+    def __init__(self, max_retries=MAX_RETRIES):
+        self.max_retries = max_retries
+        self.running_workers = []
+        self.num_spawned = 0
+        self.num_crashed = 0
+        self._lock = threading.Lock()
+    def _spawn(self, command):
+        with self._lock:
+            self.num_spawned += 1
+            self.running_workers = [worker for worker in self.running_workers if worker.is_alive()]
+            worker = SearchWorker(command)
+            self.running_workers.append(worker)
+        return worker
+    def start(self, command, task_input):
+        return self._spawn(command).submit(task_input)
+    def search(self, command, task_input, timeout=INF):
+        for attempt in range(self.max_retries + 1):
+            worker = self.start(command, task_input)
+            worker.wait(timeout)
+            if not worker.crashed:
+                break
+            self.num_crashed += 1
+            print('Search worker {} crashed with return code {} (attempt {})'.format(
+                worker, worker.returncode, attempt + 1))
+        return worker
+    def close(self):
+        with self._lock:
+            for worker in self.running_workers:
+                worker.kill()
+            self.running_workers = []
+    def __repr__(self):
+        return '{}(spawned={}, crashed={})'.format(
+            self.__class__.__name__, self.num_spawned, self.num_crashed)
+
+##################################################
+
+_search_pool = None
+_search_pool_pid = None
+
+def get_search_pool():
+    # A forked child must not kill the workers spawned by its parent
+    global _search_pool, _search_pool_pid
+    if (_search_pool is None) or (_search_pool_pid != os.getpid()):
+        _search_pool = SearchPool()
+        _search_pool_pid = os.getpid()
+        atexit.register(_search_pool.close)
+    return _search_pool
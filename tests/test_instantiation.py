@@ -0,0 +1,128 @@
+import random
+import unittest
+from itertools import product
+
+from pddlstream.conversion import evaluations_from_init, get_args, get_prefix, head_from_fact, is_atom
+from pddlstream.instantiation import Instantiator, StreamQueue, get_mapping
+from pddlstream.object import Object, ObjectRegistry
+from pddlstream.stream import Stream, from_test
+
+PARAMETERS = ['?a', '?b', '?c']
+PREDICATES = {'p': 1, 'q': 2}
+
+
+class ProductInstantiator(Instantiator):
+    # The cartesian product instantiation that the indexed joins replaced
+    def add_atom(self, atom, depth=0):
+        if not is_atom(atom):
+            return False
+        head = atom.head
+        if head in self.atoms:
+            return False
+        self.atoms.add(head)
+        for i, stream in enumerate(self.streams):
+            for j, domain_atom in enumerate(stream.domain):
+                if get_prefix(head) != get_prefix(domain_atom):
+                    continue
+                if any(isinstance(b, Object) and (a != b) for (a, b) in
+                       zip(head.args, get_args(domain_atom))):
+                    continue
+                self.atoms_from_domain[(i, j)].append(head)
+                values = [self.atoms_from_domain[(i, k)] if j != k else [head]
+                          for k in range(len(stream.domain))]
+                domain = list(map(head_from_fact, stream.domain))
+                for combo in product(*values):
+                    mapping = get_mapping(domain, combo)
+                    if mapping is not None:
+                        self._add_instance(stream, tuple(mapping[p] for p in stream.inputs))
+        return True
+
+
+def get_random_domain(rng, num_atoms=3):
+    while True:
+        domain = []
+        for _ in range(num_atoms):
+            predicate = rng.choice(sorted(PREDICATES))
+            domain.append((predicate,) + tuple(rng.choice(PARAMETERS) for _ in range(PREDICATES[predicate])))
+        inputs = sorted({a for atom in domain for a in atom[1:]})
+        if len(inputs) == len(PARAMETERS):
+            return inputs, domain
+
+
+def get_random_init(rng, num_values=3, num_facts=16):
+    init = []
+    for _ in range(num_facts):
+        predicate = rng.choice(sorted(PREDICATES))
+        init.append((predicate,) + tuple(rng.randint(0, num_values - 1) for _ in range(PREDICATES[predicate])))
+    return init
+
+
+class TestJoinOrder(unittest.TestCase):
+    def test_product_order(self):
+        # Indexed joins must produce the instances of the cartesian product in the same (FIFO) order
+        for seed in range(100):
+            rng = random.Random(seed)
+            inputs, domain = get_random_domain(rng)
+            init = get_random_init(rng)
+            orders = []
+            for instantiator_cls in [ProductInstantiator, Instantiator]:
+                with ObjectRegistry():
+                    stream = Stream('s', from_test(lambda *args: True), inputs, domain, [], [], None)
+                    instantiator = instantiator_cls(evaluations_from_init(init), [stream])
+                    orders.append([tuple(o.value for o in instance.input_objects)
+                                   for instance in instantiator.stream_queue])
+            self.assertEqual(orders[0], orders[1], msg='Seed {}: {}'.format(seed, domain))
+
+
+class Instance(object):
+    def __init__(self, name, priority):
+        self.name = name
+        self.priority = priority
+    def __repr__(self):
+        return self.name
+
+
+class TestStreamQueue(unittest.TestCase):
+    def test_fifo(self):
+        queue = StreamQueue()
+        for name in 'abc':
+            queue.append(Instance(name, 0))
+        self.assertEqual([queue.popleft().name for _ in range(3)], list('abc'))
+
+    def test_priority(self):
+        queue = StreamQueue(lambda instance: instance.priority)
+        for name, priority in [('a', 2), ('b', 1), ('c', 1)]:
+            queue.append(Instance(name, priority))
+        self.assertEqual([queue.popleft().name for _ in range(3)], list('bca'))
+
+    def test_layers(self):
+        # A re-queued instance with the best priority does not starve the rest of its layer
+        queue = StreamQueue(lambda instance: instance.priority)
+        for name, priority in [('best', -1), ('a', 0), ('b', 0)]:
+            queue.append(Instance(name, priority))
+        names = []
+        for _ in range(7):
+            instance = queue.popleft()
+            names.append(instance.name)
+            queue.append(instance)
+        self.assertEqual(names, ['best', 'a', 'b', 'best', 'a', 'b', 'best'])
+
+    def test_recompute_priority(self):
+        # Priorities are recomputed when a layer starts
+        queue = StreamQueue(lambda instance: instance.priority)
+        a, b = Instance('a', 0), Instance('b', 1)
+        queue.append(a)
+        queue.append(b)
+        a.priority = 2
+        self.assertEqual([queue.popleft().name for _ in range(2)], ['b', 'a'])
+
+    def test_pop_all(self):
+        queue = StreamQueue(lambda instance: instance.priority)
+        for name, priority in [('a', 2), ('b', 1), ('c', 0)]:
+            queue.append(Instance(name, priority))
+        self.assertEqual([i.name for i in queue.pop_all(lambda i: i.name != 'b')], ['c', 'a'])
+        self.assertEqual([i.name for i in queue], ['b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
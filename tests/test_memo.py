@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from pddlstream.memo import ResultMemo
+from pddlstream.object import Object, ObjectRegistry
+from pddlstream.stream import Stream, StreamInfo
+
+SLEEP = 0.05
+
+generated = [] # Values computed by the generators (across copies restored from the memo)
+
+
+class CountIterator(object):
+    # Picklable generator state
+    def __init__(self, x):
+        self.x = x
+        self.i = 0
+    def __iter__(self):
+        return self
+    def __next__(self):
+        generated.append(self.i)
+        self.i += 1
+        return [(self.x + self.i - 1,)]
+    next = __next__
+
+
+def count_gen(x):
+    i = 0
+    while True:
+        generated.append(i)
+        yield [(x + i,)]
+        i += 1
+
+
+def sleepy_gen(x):
+    while True:
+        time.sleep(SLEEP)
+        yield [(x,)]
+
+
+class TestResultMemo(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'memo.db')
+        del generated[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_values(self, gen_fn, num_calls):
+        # Simulates a new run
+        values = []
+        with ObjectRegistry(), ResultMemo(self.filename):
+            stream = Stream('count', gen_fn, ['?x'], [], ['?y'], [], StreamInfo())
+            instance = stream.get_instance([Object.from_value(10)])
+            for _ in range(num_calls):
+                values.extend(result.output_objects[0].value for result in instance.next_results())
+        return values, instance
+
+    def test_overhead(self):
+        _, instance = self.get_values(sleepy_gen, 1)
+        self.assertGreaterEqual(instance.total_overhead, SLEEP)
+        start_time = time.time()
+        _, instance = self.get_values(sleepy_gen, 1)
+        self.assertLess(time.time() - start_time, SLEEP)
+        self.assertGreaterEqual(instance.total_overhead, SLEEP)
+
+    def test_resume(self):
+        self.assertEqual(self.get_values(CountIterator, 2)[0], [10, 11])
+        self.assertEqual(self.get_values(CountIterator, 3)[0], [10, 11, 12])
+        self.assertEqual(generated, [0, 1, 2])
+
+    def test_replay(self):
+        # Native generators cannot be pickled, so the calls served from the memo are replayed
+        self.assertEqual(self.get_values(count_gen, 2)[0], [10, 11])
+        self.assertEqual(self.get_values(count_gen, 3)[0], [10, 11, 12])
+        self.assertEqual(generated, [0, 1, 0, 1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
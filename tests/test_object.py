@@ -0,0 +1,47 @@
+import struct
+import unittest
+
+from pddlstream.object import Object, ObjectRegistry, get_content_key
+
+
+class Array(object):
+    # Minimal stand-in for a float64 NumPy array
+    __hash__ = None
+    def __init__(self, values):
+        self.values = list(values)
+        self.dtype = 'float64'
+        self.shape = (len(self.values),)
+    def __truediv__(self, other):
+        return Array(v / other for v in self.values)
+    __div__ = __truediv__
+    def __add__(self, other):
+        return Array(v + other for v in self.values)
+    def round(self):
+        return Array(float(round(v)) for v in self.values)
+    def tobytes(self):
+        return struct.pack('{}d'.format(len(self.values)), *self.values)
+
+
+class TestContentHashing(unittest.TestCase):
+    def test_negative_zero(self):
+        self.assertEqual(get_content_key(Array([-0.001]), 0.01), get_content_key(Array([0.001]), 0.01))
+
+    def test_duplicate_counted_once(self):
+        with ObjectRegistry(hash_content=True) as registry:
+            obj = Object.from_value(Array([1.0]))
+            duplicate = Array([1.0])
+            for _ in range(3):
+                self.assertIs(Object.from_value(duplicate), obj)
+            self.assertIs(Object.from_value(Array([1.0])), obj)
+            self.assertEqual(registry.num_duplicates, 2)
+            self.assertEqual(len(registry), 1)
+
+    def test_identity(self):
+        with ObjectRegistry(hash_content=False) as registry:
+            obj = Object.from_value(Array([1.0]))
+            self.assertIsNot(Object.from_value(Array([1.0])), obj)
+            self.assertEqual(registry.num_duplicates, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
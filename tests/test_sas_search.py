@@ -0,0 +1,32 @@
+import unittest
+
+from pddlstream.sas_search import SASProblem, h_ff, h_max, python_search
+
+
+class Namespace(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def get_derived_task():
+    # Variable 1 is derived (true while variable 0 is 0) and the goal is its default value
+    return Namespace(variables=Namespace(ranges=[2, 2], axiom_layers=[-1, 0]),
+                     init=Namespace(values=[0, 0]), goal=Namespace(pairs=[(1, 0)]), metric=False,
+                     operators=[Namespace(name='(flip)', prevail=[], pre_post=[(0, 0, 1, [])], cost=1)],
+                     axioms=[Namespace(effect=(1, 1), condition=[(0, 0)])])
+
+
+class TestPythonSearch(unittest.TestCase):
+    def test_derived_default(self):
+        problem = SASProblem(get_derived_task())
+        self.assertEqual(problem.init, [0, 1])
+        self.assertEqual(h_max(problem, tuple(problem.init)), 0)
+        self.assertEqual(h_ff(problem, tuple(problem.init)), 0)
+
+    def test_planners(self):
+        for planner in ['dijkstra', 'max-astar', 'ff-astar', 'ff-wastar3', 'cea-wastar5', 'ff-lazy']:
+            self.assertEqual(python_search(get_derived_task(), planner), '(flip)\n; cost = 1 (general cost)\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pddlstream import statistics
+from pddlstream.statistics import get_planner_statistics, read_planner_statistics, record_planner_win, \
+    write_planner_statistics
+
+
+class TestPlannerStatistics(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = statistics.DATA_DIR
+        statistics.DATA_DIR = tempfile.mkdtemp()
+        self.reset()
+
+    def tearDown(self):
+        shutil.rmtree(statistics.DATA_DIR)
+        statistics.DATA_DIR = self.data_dir
+        self.reset()
+
+    def reset(self):
+        # Simulates a new process
+        statistics._planner_statistics = None
+        statistics._planner_increments.clear()
+
+    def test_concurrent_writes(self):
+        # Both solves load the statistics before either one writes
+        get_planner_statistics()
+        record_planner_win('domain', 'ff-astar', 1.)
+        increments = dict(statistics._planner_increments)
+        self.reset()
+        get_planner_statistics()
+        record_planner_win('domain', 'ff-astar', 2.)
+        record_planner_win('domain', 'dijkstra', 3.)
+        write_planner_statistics(verbose=False)
+        statistics._planner_increments.update(increments)
+        write_planner_statistics(verbose=False)
+        planners = read_planner_statistics()['domain']
+        self.assertEqual(planners['ff-astar'], {'wins': 2, 'runtime': 3.})
+        self.assertEqual(planners['dijkstra'], {'wins': 1, 'runtime': 3.})
+        self.assertEqual(get_planner_statistics(), read_planner_statistics())
+        self.assertFalse(any(name.startswith(statistics.PLANNER_FILENAME + '.')
+                             for name in os.listdir(statistics.DATA_DIR)))
+
+
+if __name__ == '__main__':
+    unittest.main()
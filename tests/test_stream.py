@@ -0,0 +1,59 @@
+import random
+import sys
+import time
+import unittest
+
+from pddlstream.object import Object, ObjectRegistry
+from pddlstream.stream import Stream, StreamInfo, from_gen_fn
+
+NUM_OUTPUTS = 20
+
+
+def sleepy_gen(x):
+    # Sleeps to widen the windows in which the consumer and the prefetching thread interleave
+    for i in range(NUM_OUTPUTS):
+        time.sleep(1e-4*random.random())
+        yield (i,)
+
+
+def failing_gen(x):
+    yield (0,)
+    raise ValueError(x)
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.switch_interval = getattr(sys, 'getswitchinterval', lambda: None)()
+        if self.switch_interval is not None:
+            sys.setswitchinterval(1e-6) # Forces frequent thread switches (Python 3)
+
+    def tearDown(self):
+        if self.switch_interval is not None:
+            sys.setswitchinterval(self.switch_interval)
+
+    def get_values(self, instance):
+        values = []
+        while not instance.enumerated:
+            values.extend(result.output_objects[0].value for result in instance.next_results())
+            time.sleep(1e-4*random.random())
+        return values
+
+    def test_single_owner(self):
+        # A generator advanced by two threads at once raises ValueError('generator already executing')
+        random.seed(0)
+        with ObjectRegistry():
+            stream = Stream('sample', from_gen_fn(sleepy_gen), ['?x'], [], ['?y'], [], StreamInfo(prefetch=2))
+            for trial in range(100):
+                instance = stream.get_instance([Object.from_value(trial)])
+                self.assertEqual(self.get_values(instance), list(range(NUM_OUTPUTS)))
+
+    def test_exception(self):
+        with ObjectRegistry():
+            stream = Stream('fail', from_gen_fn(failing_gen), ['?x'], [], ['?y'], [], StreamInfo(prefetch=2))
+            instance = stream.get_instance([Object.from_value(0)])
+            self.assertEqual(len(instance.next_results()), 1)
+            self.assertRaises(ValueError, instance.next_results)
+
+
+if __name__ == '__main__':
+    unittest.main()